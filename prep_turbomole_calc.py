@@ -1,14 +1,44 @@
 #!/usr/bin/env python3
 
 import pexpect
-
-from typing import Dict, Any, Optional
+import numpy as np
+
+from typing import (
+    Dict,
+    Any,
+    Optional,
+    Iterator,
+    Set,
+    Deque,
+    Tuple,
+    List,
+    Sequence,
+    Callable,
+)
+from contextlib import contextmanager, redirect_stdout
+from collections import deque
+from dataclasses import dataclass, replace
 
 import argparse
 import json
 import sys
 import subprocess
 import os
+import re
+import time
+import zlib
+import socket
+import signal
+import threading
+import multiprocessing
+import queue
+import hashlib
+import shutil
+import shlex
+import sqlite3
+import tarfile
+import tempfile
+import functools
 
 default_key = "-DeFaUlT-"
 array_type_key = "-ArRaYtYpE-"
@@ -23,6 +53,7 @@ molecule_options = {
     "use_internal_coords": bool,
     "detect_symmetry": bool,
     "charge": int,
+    "mo_guess": str,
     "isotopes": {
         default_key: [int, {"nucleon_count": int, "gyromagnetic_ratio": float, "quadrupole": float}]
     },
@@ -31,11 +62,21 @@ cosmo_options = {
     "enable": bool,
     "gauss": bool,
     "nleb": int,
-    "epsilon": [float, str]
+    "epsilon": [float, str],
+    "refind": float,
+    "builtin": bool,
 }
 basis_set_options = {default_key: str, "use_ecp": bool}
 pop_options = {"enable": bool, "method": str}
 x2c_options = {"enable": bool, "local_approx": bool, "picture_change_corr": bool}
+parallel_options = {
+    "enable": bool,
+    "architecture": str,
+    "cores": int,
+    "nodes": int,
+    "threads": int,
+    "scratch": str,
+}
 
 param_types = {
     "title": str,
@@ -50,10 +91,23 @@ param_types = {
         "x2c": [bool, x2c_options],
         "pop_analysis": [bool, pop_options],
         "generic": {array_type_key: str},
-        "ri": [str, {"type": str, "multipole_acceleration": bool, "memory": int}],
+        "ri": [
+            str,
+            {"type": str, "multipole_acceleration": bool, "memory": [int, str]},
+        ],
     },
+    "parallel": [bool, parallel_options],
 }
 
+# Element symbols ordered by their nuclear charge
+element_symbols: Sequence[str] = """
+h he li be b c n o f ne na mg al si p s cl ar k ca sc ti v cr mn fe co ni cu
+zn ga ge as se br kr rb sr y zr nb mo tc ru rh pd ag cd in sn sb te i xe cs ba
+la ce pr nd pm sm eu gd tb dy ho er tm yb lu hf ta w re os ir pt au hg tl pb
+bi po at rn fr ra ac th pa u np pu am cm bk cf es fm md no lr rf db sg bh hs
+mt ds rg cn nh fl mc lv ts og
+""".split()
+
 
 def optional_match_group(process: pexpect.spawn, group: int) -> Optional[str]:
     match = process.match.group(group)  # type: ignore
@@ -181,10 +235,165 @@ def validate_parameter(
             )
 
 
-def setup(process: pexpect.spawn, params: Dict[str, Any]):
+def parse_index_ranges(expr: str) -> List[int]:
+    # Parses expressions like "1,2,6-9" into the list of contained (1-based) indices
+    indices: List[int] = []
+    for part in expr.replace(" ", "").split(","):
+        if len(part) == 0:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            indices.extend(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(part))
+
+    return indices
+
+
+def compact_index_ranges(indices: List[int]) -> str:
+    # Inverse of parse_index_ranges, e.g. [1, 2, 3, 5] -> "1-3,5"
+    ranges: List[str] = []
+    ordered = sorted(set(indices))
+    i = 0
+    while i < len(ordered):
+        j = i
+        while j + 1 < len(ordered) and ordered[j + 1] == ordered[j] + 1:
+            j += 1
+        if j == i:
+            ranges.append(str(ordered[i]))
+        else:
+            ranges.append("{}-{}".format(ordered[i], ordered[j]))
+        i = j + 1
+
+    return ",".join(ranges)
+
+
+def send_lines(process: pexpect.spawn, lines: List[str]):
+    # Sending all lines in a single write avoids paying pexpect's delaybeforesend for every line
+    process.send("".join(x + os.linesep for x in lines))
+
+
+def read_control_section(
+    path: str, name: str, include_header: bool = False
+) -> Optional[List[str]]:
+    # Returns the lines of the $name section in the given control(-type) file (following
+    # file= references) or None if there is no such section. If requested, the first line
+    # is the section's header (without file= references).
+    header = "$" + name
+
+    with open(path, "r") as control_file:
+        lines = control_file.read().splitlines()
+
+    for i, line in enumerate(lines):
+        if line.rstrip() != header and not line.startswith(header + " "):
+            continue
+
+        options = line[len(header) :].split()
+        for option in options:
+            if option.startswith("file="):
+                referenced = os.path.join(os.path.dirname(path), option[len("file=") :])
+                if os.path.abspath(referenced) != os.path.abspath(path):
+                    body = read_control_section(referenced, name, include_header)
+                    if body is not None and include_header:
+                        body[0] = " ".join(
+                            [body[0]]
+                            + [x for x in options if not x.startswith("file=")]
+                        )
+                    return body
+
+        body = [line] if include_header else []
+        for current in lines[i + 1 :]:
+            if current.startswith("$"):
+                break
+            body.append(current)
+
+        return body
+
+    return None
+
+
+def read_coord_elements(path: str) -> List[str]:
+    section = read_control_section(path, "coord")
+    if section is None:
+        raise RuntimeError("No $coord section found in '{}'".format(path))
+
+    elements: List[str] = []
+    for line in section:
+        parts = line.split()
+        if len(parts) >= 4:
+            elements.append(parts[3].lower())
+
+    return elements
+
+
+def read_atom_basis_sets(control_path: str, kind: str = "basis") -> Dict[int, str]:
+    # Maps (1-based) atom indices to the name of the basis set of the given kind (e.g. "basis"
+    # or "jbas") assigned in the $atoms section
+    section = read_control_section(control_path, "atoms")
+    assignment: Dict[int, str] = {}
+    if section is None:
+        return assignment
+
+    current: List[int] = []
+    for line in section:
+        atom_match = re.match(r"^([a-z]{1,2})\s+([\d,\-]+)", line)
+        if atom_match is not None:
+            current = parse_index_ranges(atom_match.group(2))
+            continue
+
+        basis_match = re.search(r"\b{}\s*=\s*\S+\s+([^\s\\]+)".format(kind), line)
+        if basis_match is not None:
+            for index in current:
+                assignment[index] = basis_match.group(1)
+
+    return assignment
+
+
+def read_ecp_core_electrons(control_path: str) -> Dict[str, int]:
+    # Maps element symbols to the number of core electrons replaced by their ECP
+    section = read_control_section(control_path, "ecp")
+    core_electrons: Dict[str, int] = {}
+    if section is None:
+        return core_electrons
+
+    element: Optional[str] = None
+    for line in section:
+        element_match = re.match(r"^([a-z]{1,2})\s+\S+", line)
+        if element_match is not None:
+            element = element_match.group(1)
+            continue
+
+        ncore_match = re.search(r"ncore\s*=\s*(\d+)", line)
+        if ncore_match is not None and element is not None:
+            core_electrons[element] = int(ncore_match.group(1))
+
+    return core_electrons
+
+
+def count_occupied_electrons(control_path: str) -> Optional[float]:
+    total = 0.0
+    found = False
+    for name in ["closed shells", "alpha shells", "beta shells"]:
+        section = read_control_section(control_path, name)
+        if section is None:
+            continue
+
+        found = True
+        for line in section:
+            shell_match = re.match(
+                r"^\s*\S+\s+([\d,\-\s]+?)\s*\(\s*([\d.]+)\s*\)", line
+            )
+            if shell_match is not None:
+                n_orbitals = len(parse_index_ranges(shell_match.group(1)))
+                total += n_orbitals * float(shell_match.group(2))
+
+    return total if found else None
+
+
+def setup(process: pexpect.spawn, params: Dict[str, Any], import_from: str = ""):
     # Whether we want to import from another control file
     process.expect("THEN ENTER ITS LOCATION/NAME OR OTHERWISE HIT >return<.\r\n\r\n")
-    process.sendline("")
+    process.sendline(import_from)
     process.expect("TO REPEAT DEFINITION OF DEFAULT INPUT FILE")
     process.sendline(params.get("title", ""))
 
@@ -192,10 +401,6 @@ def setup(process: pexpect.spawn, params: Dict[str, Any]):
 def configure_geometry(process: pexpect.spawn, params: Dict[str, Any]):
     headline = r"SPECIFICATION OF MOLECULAR GEOMETRY \(\s*#ATOMS=(\d+)\s*SYMMETRY=([a-zA-Z_0-9]+)\s+\)"
     end_of_prompt = "OF THAT COMMAND MAY BE GIVEN"
-    internal_coord_prompt = (
-        r"IF YOU DO NOT WANT TO USE INTERNAL COORDINATES ENTER\s*no\r\n"
-    )
-    next_menu = r"GOBACK=& \(TO GEOMETRY MENU !\)\r\n"
 
     process.expect(headline)
     process.expect(end_of_prompt)
@@ -219,12 +424,35 @@ def configure_geometry(process: pexpect.spawn, params: Dict[str, Any]):
         print("Detected symmetry: {}".format(sym))
         process.expect(end_of_prompt)
 
-    use_internals = params["molecule"].get("use_internal_coords", True)
-
-    if use_internals:
+    if params["molecule"].get("use_internal_coords", True):
         process.sendline("ired")
         process.expect(end_of_prompt)
 
+    leave_geometry_menu(process, params)
+
+
+def keep_geometry(process: pexpect.spawn, params: Dict[str, Any]):
+    # The geometry (including symmetry and internal coordinates) has been imported from a checkpoint
+    headline = r"SPECIFICATION OF MOLECULAR GEOMETRY \(\s*#ATOMS=(\d+)\s*SYMMETRY=([a-zA-Z_0-9]+)\s+\)"
+    end_of_prompt = "OF THAT COMMAND MAY BE GIVEN"
+
+    process.expect(headline)
+    if int(match_group(process, 1)) == 0:
+        raise RuntimeError("Failed at importing the geometry from the checkpoint")
+    print("Imported geometry with symmetry {}".format(match_group(process, 2)))
+    process.expect(end_of_prompt)
+
+    leave_geometry_menu(process, params)
+
+
+def leave_geometry_menu(process: pexpect.spawn, params: Dict[str, Any]):
+    internal_coord_prompt = (
+        r"IF YOU DO NOT WANT TO USE INTERNAL COORDINATES ENTER\s*no\r\n"
+    )
+    next_menu = r"GOBACK=& \(TO GEOMETRY MENU !\)\r\n"
+
+    use_internals = params["molecule"].get("use_internal_coords", True)
+
     process.sendline("*")
 
     if not use_internals:
@@ -251,10 +479,6 @@ def configure_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
     headline = r"ATOMIC ATTRIBUTE DEFINITION MENU\s*\(\s*#atoms=(\d+)\s*#bas=(\d+)\s*#ecp=(\d+)\s*\)"
     end_of_prompt = r"GOBACK=& \(TO GEOMETRY MENU !\)\r\n"
     basis_set_not_found = r"THERE ARE NO DATA SETS CATALOGUED IN FILE\s*\r\n(.+)\r\n\s*CORRESPONDING TO NICKNAME\s*([^\n]+)\r\n"
-    isotope_header = r"ENTER A SET OF ATOMS TO WHICH YOU WANT TO ASSIGN ISOTOPES"
-    isotope_no_gyrmag = r"NO GYROMAGNETIC RATIO WAS FOUND IN THE DATABASE"
-    isotope_no_quadru = r"NO NUCLEAR QUADRUPOLE MOMENT WAS FOUND IN THE DATABASE"
-    isotope_assigned = r"SUPPLYING ISOTOPES TO"
 
     process.expect(headline)
     process.expect(end_of_prompt)
@@ -268,12 +492,20 @@ def configure_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
         # Specify basis sets
         # Always process from least specific group to most specific group
         # That means (for us) "all" before element labels before element indices
-        groups = list(basis_info.keys())
+        groups = [x for x in basis_info.keys() if x != "use_ecp"]
         groups.sort(key=basis_set_group_sort_key)
 
+        commands: List[str] = []
+        index_assignment: Dict[int, str] = {}
         for group in groups:
             basis_set = basis_info[group]
 
+            if re.fullmatch(r"[\d,\-\s]+", group) is not None:
+                # Index groups are merged such that there is one command per distinct basis set
+                for index in parse_index_ranges(group):
+                    index_assignment[index] = basis_set
+                continue
+
             if group.isalpha():
                 group = group.lower()
 
@@ -281,7 +513,18 @@ def configure_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
                 # We assume this is an element label -> wrap in quotes
                 group = '"{}"'.format(group)
 
-            process.sendline("b {} {}".format(group, basis_set))
+            commands.append("b {} {}".format(group, basis_set))
+
+        indices_by_basis: Dict[str, List[int]] = {}
+        for index in sorted(index_assignment):
+            indices_by_basis.setdefault(index_assignment[index], []).append(index)
+
+        for basis_set, indices in indices_by_basis.items():
+            commands.append("b {} {}".format(compact_index_ranges(indices), basis_set))
+
+        # The assignments are independent of each other and can thus be sent in one go
+        send_lines(process, commands)
+        for _ in commands:
             idx = process.expect([basis_set_not_found, end_of_prompt])
             if idx == 0:
                 basis_set_nick = match_group(process, 2).strip()
@@ -313,6 +556,35 @@ def configure_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
         # If no basis set was specified by the user, use TM's defaults
         print("Using default basis set(s) as proposed by TurboMole")
 
+    configure_isotopes(process, params)
+
+    process.sendline("*")
+
+
+def keep_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
+    # The basis sets have been imported from a checkpoint
+    headline = r"ATOMIC ATTRIBUTE DEFINITION MENU\s*\(\s*#atoms=(\d+)\s*#bas=(\d+)\s*#ecp=(\d+)\s*\)"
+    end_of_prompt = r"GOBACK=& \(TO GEOMETRY MENU !\)\r\n"
+
+    process.expect(headline)
+    if int(match_group(process, 1)) > int(match_group(process, 2)):
+        raise RuntimeError(
+            "Not all atoms have an associated basis set after importing the checkpoint"
+        )
+    process.expect(end_of_prompt)
+
+    configure_isotopes(process, params)
+
+    process.sendline("*")
+
+
+def configure_isotopes(process: pexpect.spawn, params: Dict[str, Any]):
+    end_of_prompt = r"GOBACK=& \(TO GEOMETRY MENU !\)\r\n"
+    isotope_header = r"ENTER A SET OF ATOMS TO WHICH YOU WANT TO ASSIGN ISOTOPES"
+    isotope_no_gyrmag = r"NO GYROMAGNETIC RATIO WAS FOUND IN THE DATABASE"
+    isotope_no_quadru = r"NO NUCLEAR QUADRUPOLE MOMENT WAS FOUND IN THE DATABASE"
+    isotope_assigned = r"SUPPLYING ISOTOPES TO"
+
     if "isotopes" in params["molecule"]:
         process.sendline("iso")
         for element in params["molecule"]["isotopes"]:
@@ -377,7 +649,86 @@ def configure_basis_set(process: pexpect.spawn, params: Dict[str, Any]):
         process.sendline("")
         process.expect(end_of_prompt)
 
-    process.sendline("*")
+
+def resolve_basis_assignment(
+    basis_info: Dict[str, Any], elements: List[str]
+) -> Dict[int, str]:
+    # Determines the basis set (name) for every atom in the same order as define would apply the groups
+    assignment: Dict[int, str] = {}
+    groups = [x for x in basis_info.keys() if x != "use_ecp"]
+    groups.sort(key=basis_set_group_sort_key)
+
+    for group in groups:
+        if group.lower() == "all":
+            indices = list(range(1, len(elements) + 1))
+        elif group.isalpha():
+            indices = [i + 1 for i, x in enumerate(elements) if x == group.lower()]
+        else:
+            indices = parse_index_ranges(group)
+
+        for index in indices:
+            assignment[index] = basis_info[group]
+
+    return assignment
+
+
+def check_mo_guess_compatibility(
+    reference: str, params: Dict[str, Any]
+) -> Optional[str]:
+    # Returns None if the MOs of the calculation in the reference directory can be used as
+    # a starting guess for the current calculation or a description of why they can't
+    try:
+        return find_mo_guess_mismatch(reference, params)
+    except (OSError, RuntimeError, ValueError) as e:
+        # A broken reference calculation is just another reason for not using it
+        return "unreadable reference calculation ({})".format(describe_error(e))
+
+
+def find_mo_guess_mismatch(reference: str, params: Dict[str, Any]) -> Optional[str]:
+    control_path = os.path.join(reference, "control")
+    if not os.path.isfile(control_path):
+        return "no control file found"
+    if not os.path.isfile(os.path.join(reference, "mos")) and not (
+        os.path.isfile(os.path.join(reference, "alpha"))
+        and os.path.isfile(os.path.join(reference, "beta"))
+    ):
+        return "no MO files found"
+
+    # Symmetry detection may have reordered the atoms, so only the composition is compared
+    elements = read_coord_elements(params["molecule"]["geometry"])
+    reference_elements = read_coord_elements(control_path)
+    if sorted(reference_elements) != sorted(elements):
+        return "different atoms"
+
+    # Without explicit basis sets, define's defaults apply, which aren't known in advance
+    if "basis_set" in params:
+        expected = resolve_basis_assignment(params["basis_set"], elements)
+        present = read_atom_basis_sets(control_path)
+        if sorted(
+            (x, expected.get(i + 1, "").lower()) for i, x in enumerate(elements)
+        ) != sorted(
+            (x, present.get(i + 1, "").lower())
+            for i, x in enumerate(reference_elements)
+        ):
+            return "different basis sets"
+
+    n_reference = count_occupied_electrons(control_path)
+    if n_reference is None:
+        return "no occupation found"
+
+    if any(x not in element_symbols for x in elements):
+        return "unknown elements"
+
+    core_electrons = read_ecp_core_electrons(control_path)
+    n_electrons = sum(
+        element_symbols.index(x) + 1 - core_electrons.get(x, 0) for x in elements
+    ) - params["molecule"].get("charge", 0)
+    if abs(n_reference - n_electrons) > 1e-6:
+        return "different occupation ({} vs. {} electrons)".format(
+            n_reference, n_electrons
+        )
+
+    return None
 
 
 def configure_occupation(process: pexpect.spawn, params: Dict[str, Any]):
@@ -391,10 +742,33 @@ def configure_occupation(process: pexpect.spawn, params: Dict[str, Any]):
     nat_orb_prompt = r"DO YOU REALLY WANT TO WRITE OUT NATURAL ORBITALS\s\?.+\r\n"
     next_menu_headline = r"GENERAL MENU : SELECT YOUR TOPIC"
 
+    use_failed = r"(?:CANNOT|COULD NOT|UNABLE TO)\s+(?:OPEN|READ|FIND)[^\r\n]*"
+
     process.expect(headline)
     process.expect(end_of_prompt)
 
-    process.sendline("eht")
+    guess = "eht"
+    reference: Optional[str] = params["molecule"].get("mo_guess")
+    mismatch: Optional[str] = None
+    if reference is not None:
+        mismatch = check_mo_guess_compatibility(reference, params)
+        if mismatch is None:
+            print("Using MOs from '{}' as initial guess".format(reference))
+            if not "basis_set" in params:
+                print(
+                    "Warning: No basis sets given - the basis sets of '{}' can't be compared to define's defaults".format(
+                        reference
+                    )
+                )
+            guess = "use {}".format(os.path.join(reference, "control"))
+        else:
+            print(
+                "Not using MOs from '{}' ({}) - falling back to eht".format(
+                    reference, mismatch
+                )
+            )
+
+    process.sendline(guess)
 
     cont = True
     while cont:
@@ -407,6 +781,7 @@ def configure_occupation(process: pexpect.spawn, params: Dict[str, Any]):
                 atom_default_prompt,
                 nat_orb_prompt,
                 next_menu_headline,
+                use_failed,
             ]
         )
         if idx == 0:
@@ -431,25 +806,48 @@ def configure_occupation(process: pexpect.spawn, params: Dict[str, Any]):
             # such that the following code can detect it properly
             process.sendline("")
             cont = False
-
-    # Note: Using eht automatically terminates the occ menu
+        elif idx == 7:
+            assert guess != "eht"
+            mismatch = "define failed: {}".format(match_group(process, 0).strip())
+            print(
+                "define failed to use MOs from '{}': {} - falling back to eht".format(
+                    reference, match_group(process, 0).strip()
+                )
+            )
+            guess = "eht"
+            process.expect(end_of_prompt)
+            process.sendline(guess)
+
+    # Note: Using eht (or use) automatically terminates the occ menu
+
+    if reference is not None:
+        record_job_metadata(
+            {
+                "mo_guess": {
+                    "reference": reference,
+                    "guess": guess.split()[0],
+                    "reason": mismatch,
+                }
+            }
+        )
 
 
-def set_generic_calc_param(process: pexpect.spawn, instruction: str, value=None):
+def generic_instruction_lines(instruction: str, value=None) -> List[str]:
     if not instruction.strip().endswith("*"):
         print(
             "Warning: Some submenus in define have to be exited via '*' "
             + "- in case of errors, try '*'s in your generic command"
         )
     parts = instruction.split(">")
-    parts = [x.strip() for x in parts]
-    for currentPart in parts:
-        process.sendline(currentPart.format(value))
+    parts = [x.strip().format(value) for x in parts]
 
     # Ensure we arrive back in the main menu
-    for _ in range(max(0, len(parts) - 1)):
-        # We're relying on being able to get a menu back up by pressing enter
-        process.sendline("")
+    # We're relying on being able to get a menu back up by pressing enter
+    return parts + [""] * max(0, len(parts) - 1)
+
+
+def set_generic_calc_param(process: pexpect.spawn, instruction: str, value=None):
+    send_lines(process, generic_instruction_lines(instruction, value))
 
 
 named_calc_params = {
@@ -561,7 +959,7 @@ def configure_ri_parameters(process: pexpect.spawn, params: Dict[str, Any]):
     marij_option = r"threshold for multipole neglect"
 
     ri_type: str = params.get("type", "ri").lower().replace(" ", "")
-    ri_memory: Optional[int] = params.get("memory")
+    ri_memory: Optional[Any] = params.get("memory")
 
     # Handle ri_type synonyms
     if ri_type in ["j", "coulomb", "rij"]:
@@ -572,6 +970,9 @@ def configure_ri_parameters(process: pexpect.spawn, params: Dict[str, Any]):
     if not ri_type in ["ri", "rijk"]:
         raise RuntimeError("Unknown RI type '{}'".format(ri_type))
 
+    if type(ri_memory) is str and ri_memory != "auto":
+        raise RuntimeError("Unknown RI memory setting '{}'".format(ri_memory))
+
     use_marij = params.get("multipole_acceleration", True)
 
     # Enable the desired RI method by entering the menu given by ri_type and then sending "on"
@@ -585,7 +986,8 @@ def configure_ri_parameters(process: pexpect.spawn, params: Dict[str, Any]):
     if not ri_active:
         raise RuntimeError("Failed to enable RI (type: '{}')".format(ri_type))
 
-    if ri_memory is not None:
+    # "auto" is resolved once the auxiliary basis set is known (see choose_ri_memory)
+    if type(ri_memory) is int:
         process.sendline(f"m {ri_memory}")
         process.expect(ri_headline)
     
@@ -730,32 +1132,498 @@ def configure_calc_params(process: pexpect.spawn, params: Dict[str, Any]):
     # first > second > third > value
     # where the different parts (separated by ">") will be entered one after another
     if "generic" in calc_params:
-        for instruction in calc_params["generic"]:
-            set_generic_calc_param(process, instruction)
+        # All instructions are sent at once and the menu renderings are collected afterwards
+        send_lines(
+            process,
+            [
+                line
+                for instruction in calc_params["generic"]
+                for line in generic_instruction_lines(instruction)
+            ],
+        )
 
+        for _ in calc_params["generic"]:
             process.expect(headline)
             process.expect(end_of_prompt)
 
     process.sendline("*")
 
 
-def run_define(params: Dict[str, Any], debug: bool = False, timeout: int = 10):
+class TranscriptBuffer:
+    """File-like sink for pexpect that only retains the most recent I/O of a session in memory"""
+
+    def __init__(self, capacity: int, compress: bool = False, block_size: int = 16384):
+        self.capacity = capacity
+        self.compress = compress
+        self.block_size = max(1, min(block_size, capacity))
+        # Sealed blocks as (uncompressed size, payload)
+        self.blocks: Deque[Tuple[int, bytes]] = deque()
+        self.sealed_size = 0
+        self.current = bytearray()
+        self.dropped = 0
+
+    def write(self, data: bytes):
+        self.current += data
+
+        while len(self.current) >= self.block_size:
+            block = bytes(self.current[: self.block_size])
+            del self.current[: self.block_size]
+            self.blocks.append(
+                (len(block), zlib.compress(block, 1) if self.compress else block)
+            )
+            self.sealed_size += len(block)
+
+            # Evict the oldest blocks once the capacity is exceeded
+            while self.sealed_size + len(self.current) > self.capacity and self.blocks:
+                size, _ = self.blocks.popleft()
+                self.sealed_size -= size
+                self.dropped += size
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        parts = [zlib.decompress(x) if self.compress else x for _, x in self.blocks]
+        parts.append(bytes(self.current))
+        return b"".join(parts)
+
+    def dump(self, path: str):
+        with open(path, "wb") as dump_file:
+            if self.dropped > 0:
+                dump_file.write(
+                    "[... {} earlier bytes discarded ...]\n".format(
+                        self.dropped
+                    ).encode("utf-8")
+                )
+            dump_file.write(self.getvalue())
+
+
+@dataclass
+class PreparationOptions:
+    # Log all I/O of define/cosmoprep to stdout
+    debug: bool = False
+    # Maximum time (in seconds) to wait on the expected output
+    timeout: int = 10
+    # Size (in bytes) of the in-memory transcript that is written to disk on failure (0 disables it)
+    transcript_size: int = 256 * 1024
+    compress_transcript: bool = False
+    # Content-addressed store into which generated artifacts are deduplicated
+    store_dir: Optional[str] = None
+    # Directory holding snapshots of the define stages shared between jobs
+    checkpoint_dir: Optional[str] = None
+    # Sanity-check the geometry before starting define
+    preflight: bool = True
+    # Number of jobs that are going to run concurrently on one node (for "memory": "auto")
+    concurrent_jobs: int = 1
+    # Memory (in MiB) available to the calculations on a node (detected if not given)
+    node_memory: Optional[int] = None
+    # Node-local directory into which the required parts of the basis set library are mirrored
+    basis_mirror: Optional[str] = None
+    # Additional environment variables for define/cosmoprep
+    environment: Optional[Dict[str, str]] = None
+    # Maximum total runtime (in seconds) of a define/cosmoprep session
+    deadline: Optional[float] = None
+    # What to do with the files a failed session has created or modified ("keep", "rollback" or
+    # "quarantine", which moves them into a subdirectory of quarantine_dir)
+    on_failure: str = "keep"
+    quarantine_dir: str = "quarantine"
+    # SQLite database in which all preparations are recorded (and which is used to skip up-to-date jobs)
+    index_path: Optional[str] = None
+
+
+class SessionHook:
+    """Base class for instrumentation hooks around define/cosmoprep sessions (all callbacks default to no-ops)"""
+
+    def session_start(self, command: str):
+        pass
+
+    def session_end(self, command: str, error: Optional[BaseException]):
+        pass
+
+    def phase_enter(self, phase: str):
+        pass
+
+    def phase_exit(self, phase: str, elapsed: float, error: Optional[BaseException]):
+        pass
+
+    def send(self, data: Any):
+        pass
+
+    def expect(self, pattern: Any, index: Optional[int], elapsed: float):
+        # index is None if the expectation could not be met (timeout or EOF)
+        pass
+
+
+session_hooks: List[SessionHook] = []
+
+hook_entry_point_group = "prep_turbomole_calc.hooks"
+
+
+def register_hook(hook: SessionHook):
+    session_hooks.append(hook)
+
+
+def load_hook_entry_points():
+    # Every entry point in the group is expected to refer to a callable (e.g. a SessionHook
+    # subclass) that creates the hook when called without arguments
+    from importlib.metadata import entry_points
+
+    available: Any = entry_points()
+    if hasattr(available, "select"):
+        selected = available.select(group=hook_entry_point_group)
+    else:
+        selected = available.get(hook_entry_point_group, [])
+
+    for entry_point in selected:
+        register_hook(entry_point.load()())
+
+
+class InstrumentedSpawn(pexpect.spawn):
+    """pexpect.spawn that reports all sends and expects to the registered hooks"""
+
+    def send(self, s):
+        for hook in session_hooks:
+            hook.send(s)
+        return super().send(s)
+
+    def expect(self, pattern, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            index = super().expect(pattern, *args, **kwargs)
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            for hook in session_hooks:
+                hook.expect(pattern, None, time.perf_counter() - start)
+            raise
+
+        for hook in session_hooks:
+            hook.expect(pattern, index, time.perf_counter() - start)
+        return index
+
+
+class ProfilingHook(SessionHook):
+    """Accumulates the time spent per phase and waiting for each pattern"""
+
+    def __init__(self):
+        self.phase = "-"
+        self.phase_times: Dict[str, List[float]] = {}
+        self.expect_times: Dict[Tuple[str, str], List[float]] = {}
+        self.n_sends = 0
+
+    def phase_enter(self, phase: str):
+        self.phase = phase
+
+    def phase_exit(self, phase: str, elapsed: float, error: Optional[BaseException]):
+        self.phase_times.setdefault(phase, []).append(elapsed)
+        self.phase = "-"
+
+    def send(self, data: Any):
+        self.n_sends += 1
+
+    def expect(self, pattern: Any, index: Optional[int], elapsed: float):
+        if type(pattern) is list:
+            pattern = (
+                pattern[index] if index is not None else "|".join(map(str, pattern))
+            )
+        key = (self.phase, " ".join(str(pattern).split()))
+        self.expect_times.setdefault(key, []).append(elapsed)
+
+    def merge(self, other: "ProfilingHook"):
+        for phase, times in other.phase_times.items():
+            self.phase_times.setdefault(phase, []).extend(times)
+        for key, times in other.expect_times.items():
+            self.expect_times.setdefault(key, []).extend(times)
+        self.n_sends += other.n_sends
+
+    def print_summary(self, max_patterns: int = 10):
+        print("Time per phase:")
+        for phase, times in sorted(self.phase_times.items(), key=lambda x: -sum(x[1])):
+            print(
+                "  {:<24} {:>5} calls {:>10.3f} s".format(phase, len(times), sum(times))
+            )
+
+        print("Slowest expectations:")
+        ranked = sorted(self.expect_times.items(), key=lambda x: -sum(x[1]))
+        for (phase, pattern), times in ranked[:max_patterns]:
+            print(
+                "  {:<24} {:>5} calls {:>10.3f} s  {}".format(
+                    phase, len(times), sum(times), pattern[:60]
+                )
+            )
+
+        print("Sends: {}".format(self.n_sends))
+
+
+def spawn_session(command: str, options: PreparationOptions) -> pexpect.spawn:
+    # Only pay for instrumentation if somebody is listening
+    spawn_type = InstrumentedSpawn if len(session_hooks) > 0 else pexpect.spawn
+    env = None
+    if options.environment is not None:
+        env = dict(os.environ, **options.environment)
+    process = spawn_type(command, env=env)
+    process.timeout = options.timeout
+    if options.debug:
+        process.logfile = sys.stdout.buffer
+    elif options.transcript_size > 0:
+        process.logfile = TranscriptBuffer(
+            options.transcript_size, compress=options.compress_transcript
+        )
+
+    return process
+
+
+def terminate_process_group(process: pexpect.spawn, grace: float = 2.0):
+    # The session's program leads its own process group (pexpect starts it in a new session), so
+    # this also takes care of any processes it has started
+    assert process.pid is not None
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            break
+        end = time.monotonic() + grace
+        while process.isalive() and time.monotonic() < end:
+            time.sleep(0.01)
+
+    # Reaps the process and releases the pty
+    process.close(force=True)
+
+
+# Files larger than this (in bytes) are not backed up for rolling back failed sessions
+max_snapshot_size = 64 * 2**20
+
+
+def snapshot_directory(
+    directory: str = ".",
+) -> Dict[str, Tuple[int, int, Optional[bytes]]]:
+    # Maps the regular files in directory to their modification time, size and content
+    snapshot: Dict[str, Tuple[int, int, Optional[bytes]]] = {}
+    for entry in os.scandir(directory):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        content = None
+        if stat.st_size <= max_snapshot_size:
+            with open(entry.path, "rb") as snapshot_file:
+                content = snapshot_file.read()
+        snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size, content)
+
+    return snapshot
+
+
+def clean_up_after_failure(
+    name: str,
+    snapshot: Dict[str, Tuple[int, int, Optional[bytes]]],
+    status: Dict[str, Any],
+    options: PreparationOptions,
+    keep: Sequence[str] = (),
+) -> Optional[str]:
+    # Rolls the current directory back to the given snapshot (except for the files in keep). Unless
+    # rolling back, the files created or modified since the snapshot are moved into a new quarantine
+    # directory, whose path is returned.
+    changed: List[str] = []
+    for entry in os.scandir("."):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        previous = snapshot.get(entry.name)
+        if previous is None or previous[:2] != (stat.st_mtime_ns, stat.st_size):
+            changed.append(entry.name)
+
+    quarantine_path = None
+    if options.on_failure == "quarantine":
+        os.makedirs(options.quarantine_dir, exist_ok=True)
+        quarantine_path = tempfile.mkdtemp(
+            prefix="{}-{}-".format(name, time.strftime("%Y%m%d-%H%M%S")),
+            dir=options.quarantine_dir,
+        )
+        with open(os.path.join(quarantine_path, "failure.json"), "w") as status_file:
+            json.dump(status, status_file, indent=2)
+
+    for file_name in changed:
+        if quarantine_path is not None:
+            shutil.copy2(file_name, os.path.join(quarantine_path, file_name))
+        if file_name in keep:
+            continue
+
+        previous = snapshot.get(file_name)
+        if previous is None:
+            os.remove(file_name)
+        elif previous[2] is not None:
+            with open(file_name, "wb") as restored_file:
+                restored_file.write(previous[2])
+            os.utime(file_name, ns=(previous[0], previous[0]))
+        else:
+            print("Warning: Unable to restore '{}' (too large)".format(file_name))
+
+    return quarantine_path
+
+
+@contextmanager
+def interactive_session(
+    command: str, options: PreparationOptions
+) -> Iterator[pexpect.spawn]:
+    name = command.split()[0]
+    snapshot = snapshot_directory() if options.on_failure != "keep" else None
+    start = time.monotonic()
+    process = spawn_session(command, options)
+    for hook in session_hooks:
+        hook.session_start(command)
+
+    # Kills the session once its deadline is reached, which makes the pending expect fail
+    expired = threading.Event()
+    watchdog: Optional[threading.Timer] = None
+    if options.deadline is not None:
+        pid = process.pid
+        assert pid is not None
+
+        def expire():
+            expired.set()
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        watchdog = threading.Timer(options.deadline, expire)
+        watchdog.daemon = True
+        watchdog.start()
+
+    try:
+        try:
+            yield process
+            # Wait for the program to finish writing its output files
+            process.expect(pexpect.EOF)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        if expired.is_set():
+            raise RuntimeError("Deadline exceeded")
+        process.close()
+    except BaseException as e:
+        terminate_process_group(process)
+
+        error: BaseException = e
+        if expired.is_set():
+            error = RuntimeError(
+                "{} exceeded its deadline of {} s".format(name, options.deadline)
+            )
+
+        status = {
+            "command": name,
+            "exit_status": process.exitstatus,
+            "signal": process.signalstatus,
+            "elapsed": round(time.monotonic() - start, 3),
+            "error": (
+                describe_error(error)
+                if isinstance(error, Exception)
+                else type(error).__name__
+            ),
+        }
+        print(
+            "{} was terminated (exit status: {}, signal: {})".format(
+                name, status["exit_status"], status["signal"]
+            )
+        )
+
+        transcript_dir = "."
+        if snapshot is not None:
+            quarantine_path = clean_up_after_failure(name, snapshot, status, options)
+            if quarantine_path is not None:
+                transcript_dir = quarantine_path
+                print(
+                    "Moved the output of the failed {} session to '{}'".format(
+                        name, quarantine_path
+                    )
+                )
+
+        if isinstance(process.logfile, TranscriptBuffer):
+            transcript_path = os.path.join(transcript_dir, "{}.transcript".format(name))
+            process.logfile.dump(transcript_path)
+            print(
+                "Transcript of the failed {} session written to '{}'".format(
+                    name, transcript_path
+                )
+            )
+        for hook in session_hooks:
+            hook.session_end(command, error)
+
+        if error is not e:
+            raise error from e
+        raise
+
+    if process.exitstatus != 0:
+        print(
+            "Warning: {} exited with status {} (signal: {})".format(
+                name, process.exitstatus, process.signalstatus
+            )
+        )
+    record_job_metadata(
+        {
+            "{}_session".format(name): {
+                "exit_status": process.exitstatus,
+                "signal": process.signalstatus,
+                "elapsed": round(time.monotonic() - start, 3),
+            }
+        }
+    )
+
+    for hook in session_hooks:
+        hook.session_end(command, None)
+
+
+def run_phase(
+    phase: Callable[[pexpect.spawn, Dict[str, Any]], None],
+    process: pexpect.spawn,
+    params: Dict[str, Any],
+):
+    if len(session_hooks) == 0:
+        phase(process, params)
+        return
+
+    name = getattr(phase, "func", phase).__name__
+    for hook in session_hooks:
+        hook.phase_enter(name)
+    start = time.perf_counter()
+    try:
+        phase(process, params)
+    except BaseException as e:
+        for hook in session_hooks:
+            hook.phase_exit(name, time.perf_counter() - start, e)
+        raise
+    for hook in session_hooks:
+        hook.phase_exit(name, time.perf_counter() - start, None)
+
+
+def run_define(
+    params: Dict[str, Any],
+    options: PreparationOptions = PreparationOptions(),
+    checkpoint: Optional[Tuple[str, str]] = None,
+):
     if os.path.exists("control") or os.path.exists("tmp.input"):
         raise RuntimeError(
             "prep_turbomole_calc can't be used in a directory where remnants of a prior define run are located "
             + "- delete all old files or use a different directory"
         )
 
-    process = pexpect.spawn("define")
-    process.timeout = timeout
-    if debug:
-        process.logfile = sys.stdout.buffer
+    phases: List[Callable[[pexpect.spawn, Dict[str, Any]], None]] = [
+        setup,
+        configure_geometry,
+        configure_basis_set,
+        configure_occupation,
+        configure_calc_params,
+    ]
 
-    setup(process, params)
-    configure_geometry(process, params)
-    configure_basis_set(process, params)
-    configure_occupation(process, params)
-    configure_calc_params(process, params)
+    if checkpoint is not None:
+        # Resume from the given (stage, control file) by letting define import the control file
+        stage, control_path = checkpoint
+        print("Resuming from {} checkpoint '{}'".format(stage, control_path))
+        phases[0] = functools.partial(setup, import_from=control_path)
+        phases[1] = keep_geometry
+        if stage == "basis":
+            phases[2] = keep_basis_set
+
+    with interactive_session("define", options) as process:
+        for phase in phases:
+            run_phase(phase, process, params)
 
 
 def configure_cosmo(process: pexpect.spawn, params: Dict[str, Any]):
@@ -837,7 +1705,103 @@ def configure_cosmo(process: pexpect.spawn, params: Dict[str, Any]):
 
 
 
-def run_cosmoprep(params: Dict[str, Any], debug: bool = False, timeout: int = 10):
+# Stages of a define session that can be restored from a snapshot (in order) and the
+# control file sections making up their result
+checkpoint_stages = ["geometry", "basis"]
+checkpoint_sections = {
+    "geometry": ["symmetry", "coord", "intdef", "redundant", "user-defined bonds"],
+    "basis": ["atoms", "basis", "ecp"],
+}
+
+
+def hash_parameters(values: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def checkpoint_keys(params: Dict[str, Any]) -> Dict[str, str]:
+    # Every stage's key covers all parameters the stage (and the stages before it) depend on
+    molecule = params["molecule"]
+    geometry_key = hash_parameters(
+        {
+            "geometry": hash_file(molecule["geometry"]),
+            "detect_symmetry": molecule.get("detect_symmetry", True),
+            "use_internal_coords": molecule.get("use_internal_coords", True),
+        }
+    )
+    basis_key = hash_parameters(
+        {"geometry": geometry_key, "basis_set": params.get("basis_set")}
+    )
+
+    return {"geometry": geometry_key, "basis": basis_key}
+
+
+def checkpoint_path(checkpoint_dir: str, stage: str, key: str) -> str:
+    return os.path.join(checkpoint_dir, "{}-{}".format(stage, key))
+
+
+def find_checkpoint(
+    checkpoint_dir: str, keys: Dict[str, str]
+) -> Optional[Tuple[str, str]]:
+    for stage in reversed(checkpoint_stages):
+        control_path = os.path.join(
+            checkpoint_path(checkpoint_dir, stage, keys[stage]), "control"
+        )
+        if os.path.isfile(control_path):
+            return stage, control_path
+
+    return None
+
+
+def strip_auxiliary_basis_sets(atoms_section: List[str]) -> List[str]:
+    # Auxiliary basis sets belong to the RI settings of a job and are not part of the basis stage
+    kept = [
+        x.rstrip(" \\")
+        for x in atoms_section
+        if re.match(r"^\s*(jbas|jkbas|cbas|cabs)\s*=", x) is None
+    ]
+    # Re-establish the line continuations within every atom block
+    return [
+        x + " \\" if i + 1 < len(kept) and kept[i + 1].startswith(" ") else x
+        for i, x in enumerate(kept)
+    ]
+
+
+def save_checkpoints(
+    checkpoint_dir: str, keys: Dict[str, str], control_path: str = "control"
+):
+    sections: List[str] = []
+
+    for stage in checkpoint_stages:
+        for name in checkpoint_sections[stage]:
+            section = read_control_section(control_path, name, include_header=True)
+            if section is None:
+                continue
+            if name == "atoms":
+                section = section[:1] + strip_auxiliary_basis_sets(section[1:])
+            sections.extend(section)
+
+        target = checkpoint_path(checkpoint_dir, stage, keys[stage])
+        if os.path.exists(target):
+            continue
+
+        # Checkpoints are written atomically as they may be used by concurrently running jobs
+        temp_dir = "{}.{}.tmp".format(target, worker_name())
+        os.makedirs(temp_dir)
+        with open(os.path.join(temp_dir, "control"), "w") as control_file:
+            control_file.write("".join(x + "\n" for x in sections) + "$end\n")
+
+        try:
+            os.rename(temp_dir, target)
+        except OSError:
+            # Another job has created the same checkpoint in the meantime
+            shutil.rmtree(temp_dir)
+
+
+def run_cosmoprep(
+    params: Dict[str, Any], options: PreparationOptions = PreparationOptions()
+):
     
     if not "calculation" in params:
         return
@@ -849,45 +1813,325 @@ def run_cosmoprep(params: Dict[str, Any], debug: bool = False, timeout: int = 10
     if not calc_params["cosmo"]["enable"]:
         return
 
+    if calc_params["cosmo"].get("builtin", False):
+        write_cosmo_sections(calc_params["cosmo"])
+        print("Wrote COSMO settings (without cosmoprep)")
+        return
+
     print("setting up cosmo ...")
-    process = pexpect.spawn("cosmoprep")
-    process.timeout = timeout
-    if debug:
-        process.logfile = sys.stdout.buffer
+    with interactive_session("cosmoprep", options) as process:
+        run_phase(configure_cosmo, process, params)
+
+
+# Bondi van der Waals radii (in Å). cosmoprep's "r all b" (as used by configure_cosmo) scales them by 1.17.
+bondi_radii = {
+    "h": 1.20,
+    "he": 1.40,
+    "li": 1.82,
+    "c": 1.70,
+    "n": 1.55,
+    "o": 1.52,
+    "f": 1.47,
+    "ne": 1.54,
+    "na": 2.27,
+    "mg": 1.73,
+    "si": 2.10,
+    "p": 1.80,
+    "s": 1.80,
+    "cl": 1.75,
+    "ar": 1.88,
+    "k": 2.75,
+    "ni": 1.63,
+    "cu": 1.40,
+    "zn": 1.39,
+    "ga": 1.87,
+    "as": 1.85,
+    "se": 1.90,
+    "br": 1.85,
+    "kr": 2.02,
+    "pd": 1.63,
+    "ag": 1.72,
+    "cd": 1.58,
+    "in": 1.93,
+    "sn": 2.17,
+    "te": 2.06,
+    "i": 1.98,
+    "xe": 2.16,
+    "pt": 1.72,
+    "au": 1.66,
+    "hg": 1.55,
+    "tl": 1.96,
+    "pb": 2.02,
+    "u": 1.86,
+}
+bondi_radius_scaling = 1.17
+
+# Radius (in Å) used for all other elements
+default_cosmo_radius = 2.223
+
+# cosmoprep's defaults for the parameters that are not exposed as options
+cosmo_defaults = [
+    "nppa= 1082",
+    "nspa= 92",
+    "disex= 10.0000",
+    "rsolv= 1.30",
+    "routf= 0.85",
+    "cavity closed",
+    "ampran= 0.1D-04",
+    "phsran= 0.0",
+]
+
+
+def cosmo_radius(element: str) -> float:
+    if element in bondi_radii:
+        return round(bondi_radius_scaling * bondi_radii[element], 4)
+    return default_cosmo_radius
+
+
+def write_cosmo_sections(cosmo_params: Dict[str, Any], control_path: str = "control"):
+    # Writes the same $cosmo, $cosmo_atoms and $cosmo_out sections as cosmoprep does when accepting
+    # its defaults (apart from the given options)
+    settings: List[str] = []
+
+    epsilon = cosmo_params.get("epsilon")
+    if type(epsilon) is str:
+        if epsilon.upper() not in ["INF", "INFINITY"]:
+            raise RuntimeError(
+                f"epsilon must either be a number or a string 'INF' or 'INFINITY' (upper or lower case); found {epsilon}"
+            )
+    elif epsilon is not None:
+        settings.append("epsilon= {}".format(epsilon))
 
-    configure_cosmo(process, params)
+    settings.extend(cosmo_defaults)
 
+    if "refind" in cosmo_params:
+        settings.append("refind= {}".format(cosmo_params["refind"]))
+    if cosmo_params.get("gauss", True):
+        settings.append("gauss")
+        settings.append("nleb= {}".format(cosmo_params.get("nleb", 3)))
 
-def handle_geometry_conversion(geom_path: str, base_path: str) -> str:
-    if not os.path.isabs(geom_path):
-        geom_path = os.path.join(base_path, geom_path)
+    atoms: Dict[str, List[int]] = {}
+    for i, element in enumerate(read_coord_elements(control_path)):
+        atoms.setdefault(element, []).append(i + 1)
 
-    _, file_ext = os.path.splitext(geom_path)
+    radii = ["# radii in Angstrom units"]
+    for element, indices in atoms.items():
+        radii.append("{:<2} {} \\".format(element, compact_index_ranges(indices)))
+        radii.append("   radius= {:7.4f}".format(cosmo_radius(element)))
 
-    if file_ext.lower() == ".xyz":
-        # Convert XYZ to TurboMole format
-        coord_file = open("coord", "w")
-        subprocess.run(["x2t", geom_path], stdout=coord_file).check_returncode()
+    set_control_keyword(control_path, "cosmo", body=[" " + x for x in settings])
+    set_control_keyword(control_path, "cosmo_atoms", body=radii)
+    set_control_keyword(control_path, "cosmo_out", "file=out.ccf")
 
-        return "coord"
-    elif not len(file_ext) == 0:
-        raise RuntimeError(
-            "Can only convert XYZ geometries to TurboMole format, but got '%s'"
-            % file_ext
-        )
 
-    return geom_path
+bohr_to_angstrom = 0.529177210903
 
+# Atoms closer than this (in Å) are considered to be overlapping
+clash_distance = 0.5
+# Range (in Å) of typical distances between hydrogen atoms and their nearest neighbour. Hydrogens without any
+# neighbour within the search radius (e.g. in weakly bound complexes) don't tell anything about the length unit.
+hydrogen_neighbour_range = (0.65, 1.6)
+hydrogen_search_radius = 2.5
 
-def handle_legacy_parameter(params: Dict[str, Any]) -> Dict[str, Any]:
-    if "calculation" in params:
-        calc_params = params["calculation"]
 
-        if "dispersion_correction" in calc_params:
-            if "dft" not in calc_params:
-                print(
-                    "Warning: Ignoring legacy dispersion_correction parameter as no DFT calculation will be performed"
-                )
+def read_geometry(path: str) -> Tuple[List[str], np.ndarray]:
+    # Returns the element symbols and the coordinates (in Å) of the given XYZ or TurboMole coord file
+    _, file_ext = os.path.splitext(path)
+
+    if file_ext.lower() != ".xyz":
+        section = read_control_section(path, "coord")
+        if section is None:
+            raise RuntimeError("No $coord section found in '{}'".format(path))
+
+        rows = [x.split() for x in section if len(x.split()) >= 4]
+        elements = [x[3].lower() for x in rows]
+        coords = np.array([x[:3] for x in rows], dtype=float).reshape(-1, 3)
+
+        return elements, coords * bohr_to_angstrom
+
+    with open(path, "r") as xyz_file:
+        lines = xyz_file.read().splitlines()
+
+    try:
+        n_atoms = int(lines[0].strip())
+    except (IndexError, ValueError):
+        raise RuntimeError(
+            "The first line of '{}' must contain the number of atoms".format(path)
+        )
+
+    rows = [x.split() for x in lines[2:] if len(x.strip()) > 0]
+    if len(rows) != n_atoms:
+        raise RuntimeError(
+            "'{}' specifies {} atoms, but contains {}".format(path, n_atoms, len(rows))
+        )
+
+    try:
+        coords = np.array([x[1:4] for x in rows], dtype=float).reshape(-1, 3)
+    except ValueError:
+        raise RuntimeError("Invalid coordinates in '{}'".format(path))
+
+    return [x[0].lower() for x in rows], coords
+
+
+def find_close_pairs(
+    coords: np.ndarray, cutoff: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Returns all pairs of atoms (i < j) that are closer than cutoff together with their distance.
+    # Atoms are sorted into cells of size cutoff such that only atoms in neighbouring cells have
+    # to be compared, which makes this O(N).
+    cells = np.floor((coords - coords.min(axis=0)) / cutoff).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    atoms = np.arange(len(coords))
+
+    pairs_i: List[np.ndarray] = []
+    pairs_j: List[np.ndarray] = []
+    distances: List[np.ndarray] = []
+    for x in (-1, 0, 1):
+        for y in (-1, 0, 1):
+            for z in (-1, 0, 1):
+                neighbour_keys = keys + (x * dims[1] + y) * dims[2] + z
+                first = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+                counts = (
+                    np.searchsorted(sorted_keys, neighbour_keys, side="right") - first
+                )
+
+                # Expand every atom's range of candidate neighbours into explicit pairs
+                i = np.repeat(atoms, counts)
+                within = np.arange(len(i)) - np.repeat(
+                    np.cumsum(counts) - counts, counts
+                )
+                j = order[np.repeat(first, counts) + within]
+
+                # Every pair is visited from both of its cells - only keep one of them
+                keep = i < j
+                i = i[keep]
+                j = j[keep]
+                d = np.linalg.norm(coords[i] - coords[j], axis=1)
+                close = d < cutoff
+
+                pairs_i.append(i[close])
+                pairs_j.append(j[close])
+                distances.append(d[close])
+
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(distances)
+
+
+def preflight_check(params: Dict[str, Any], geometry_path: str):
+    # Cheap sanity checks of the input that catch mistakes before define is even started
+    elements, coords = read_geometry(geometry_path)
+
+    if len(elements) == 0:
+        raise RuntimeError("'{}' does not contain any atoms".format(geometry_path))
+
+    unknown = sorted(set(x for x in elements if x not in element_symbols))
+    if len(unknown) > 0:
+        raise RuntimeError(
+            "Unknown element(s) in '{}': {}".format(geometry_path, ", ".join(unknown))
+        )
+
+    for element in params["molecule"].get("isotopes", {}):
+        if element.lower() not in elements:
+            raise RuntimeError(
+                "Isotope specified for '{}', but the molecule contains no such atom".format(
+                    element
+                )
+            )
+
+    for group in params.get("basis_set", {}):
+        if group == "use_ecp" or group.lower() == "all":
+            continue
+        if group.isalpha() and len(group) <= 2:
+            if group.lower() not in elements:
+                raise RuntimeError(
+                    "Basis set specified for '{}', but the molecule contains no such atom".format(
+                        group
+                    )
+                )
+        elif re.fullmatch(r"[\d,\-\s]+", group) is not None:
+            if any(x < 1 or x > len(elements) for x in parse_index_ranges(group)):
+                raise RuntimeError(
+                    "Basis set group '{}' refers to atoms that don't exist (the molecule has {} atoms)".format(
+                        group, len(elements)
+                    )
+                )
+
+    if len(elements) < 2:
+        return
+
+    i, j, distances = find_close_pairs(coords, cutoff=hydrogen_search_radius)
+
+    clashes = distances < clash_distance
+    if np.any(clashes):
+        pairs = [
+            "{}{}-{}{} ({:.2f} Å)".format(elements[a], a + 1, elements[b], b + 1, d)
+            for a, b, d in zip(i[clashes][:5], j[clashes][:5], distances[clashes][:5])
+        ]
+        raise RuntimeError(
+            "Overlapping atoms in '{}': {}".format(geometry_path, ", ".join(pairs))
+        )
+
+    # Hydrogens are (almost) always bonded and thus reveal whether the length unit is wrong
+    nearest = np.full(len(elements), np.inf)
+    np.minimum.at(nearest, i, distances)
+    np.minimum.at(nearest, j, distances)
+    is_hydrogen = np.array([x == "h" for x in elements])
+    judged = is_hydrogen & np.isfinite(nearest)
+    if np.any(is_hydrogen) and not np.any(judged):
+        print(
+            "Warning: None of the hydrogen atoms in '{}' has a neighbour within {} Å - unable to check the length unit".format(
+                geometry_path, hydrogen_search_radius
+            )
+        )
+    elif np.any(judged):
+        typical = np.median(nearest[judged])
+        if typical > hydrogen_neighbour_range[1]:
+            raise RuntimeError(
+                "Hydrogen atoms in '{}' are unusually far from their neighbours - are the coordinates given in Bohr instead of Å?".format(
+                    geometry_path
+                )
+            )
+        if typical < hydrogen_neighbour_range[0]:
+            raise RuntimeError(
+                "Hydrogen atoms in '{}' are unusually close to their neighbours - are the coordinates given in Å instead of Bohr?".format(
+                    geometry_path
+                )
+            )
+
+
+def handle_geometry_conversion(geom_path: str, base_path: str) -> str:
+    if not os.path.isabs(geom_path):
+        geom_path = os.path.join(base_path, geom_path)
+
+    _, file_ext = os.path.splitext(geom_path)
+
+    if file_ext.lower() == ".xyz":
+        # Convert XYZ to TurboMole format
+        coord_file = open("coord", "w")
+        subprocess.run(["x2t", geom_path], stdout=coord_file).check_returncode()
+
+        return "coord"
+    elif not len(file_ext) == 0:
+        raise RuntimeError(
+            "Can only convert XYZ geometries to TurboMole format, but got '%s'"
+            % file_ext
+        )
+
+    return geom_path
+
+
+def handle_legacy_parameter(params: Dict[str, Any]) -> Dict[str, Any]:
+    if "calculation" in params:
+        calc_params = params["calculation"]
+
+        if "dispersion_correction" in calc_params:
+            if "dft" not in calc_params:
+                print(
+                    "Warning: Ignoring legacy dispersion_correction parameter as no DFT calculation will be performed"
+                )
                 del calc_params["dispersion_correction"]
             else:
                 dft_options = calc_params["dft"]
@@ -988,9 +2232,1635 @@ def expand_param_shortcuts(params: Dict[str, Any]) -> Dict[str, Any]:
         if "cosmo" in calc_options and "enable" not in calc_options["cosmo"]:
             calc_options["cosmo"]["enable"] = True
 
+    if "parallel" in params and type(params["parallel"]) is bool:
+        params["parallel"] = {"enable": params["parallel"]}
+    if "parallel" in params and "enable" not in params["parallel"]:
+        params["parallel"]["enable"] = True
+
     return params
 
 
+@contextmanager
+def cleanup_on_failure(options: PreparationOptions) -> Iterator[PreparationOptions]:
+    # Cleans up after a failed job as a whole rather than after its individual sessions, as e.g.
+    # define's output is of no use either if cosmoprep fails afterwards. The yielded options are to
+    # be used for the job's sessions.
+    if options.on_failure == "keep":
+        yield options
+        return
+
+    snapshot = snapshot_directory()
+    start = time.monotonic()
+    try:
+        yield replace(options, on_failure="keep")
+    except BaseException as e:
+        status = {
+            "directory": os.getcwd(),
+            "elapsed": round(time.monotonic() - start, 3),
+            "error": describe_error(e) if isinstance(e, Exception) else type(e).__name__,
+        }
+        # Transcripts of failed sessions are kept for inspection
+        transcripts = [x for x in os.listdir(".") if x.endswith(".transcript")]
+        quarantine_path = clean_up_after_failure(
+            "job", snapshot, status, options, keep=transcripts
+        )
+        if quarantine_path is not None:
+            print("Moved the output of the failed job to '{}'".format(quarantine_path))
+        else:
+            print("Rolled back the output of the failed job")
+        raise
+
+
+def prepare_calculation(
+    parameter: Dict[str, Any],
+    param_dir: str,
+    options: PreparationOptions = PreparationOptions(),
+    location: Optional[str] = None,
+):
+    # Prepares the job in the current directory and records it in the index (if any) under its
+    # location (defaults to the current directory)
+    if options.index_path is None:
+        with cleanup_on_failure(options) as job_options:
+            run_preparation(parameter, param_dir, job_options)
+        return
+
+    parameter = normalize_parameters(parameter, param_dir)
+    if parameter["molecule"]["geometry"] == "-":
+        parameter["molecule"]["geometry"] = read_geometry_from_stdin()
+
+    record: Dict[str, Any] = {
+        "directory": os.path.realpath(location if location is not None else "."),
+        "parameters": json.dumps(parameter, sort_keys=True),
+        "input_hashes": json.dumps(hash_inputs(parameter), sort_keys=True),
+        "host": socket.gethostname(),
+        "started": time.time(),
+    }
+
+    try:
+        with cleanup_on_failure(options) as job_options:
+            run_preparation(parameter, param_dir, job_options)
+        record["outcome"] = "done"
+        if os.path.isfile(job_metadata_file):
+            with open(job_metadata_file, "r") as metadata_file:
+                record["metadata"] = metadata_file.read()
+    except Exception as e:
+        record["outcome"] = "failed"
+        record["error"] = describe_error(e)
+        raise
+    except BaseException as e:
+        record["outcome"] = "interrupted"
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["finished"] = time.time()
+        with open_index(options.index_path) as index:
+            index.execute(
+                "INSERT OR REPLACE INTO jobs ({}) VALUES ({})".format(
+                    ", ".join(record.keys()), ", ".join("?" * len(record))
+                ),
+                list(record.values()),
+            )
+
+
+def run_preparation(
+    parameter: Dict[str, Any],
+    param_dir: str,
+    options: PreparationOptions = PreparationOptions(),
+):
+    parameter = expand_param_shortcuts(params=parameter)
+    parameter = handle_legacy_parameter(params=parameter)
+
+    if not "molecule" in parameter or not "geometry" in parameter["molecule"]:
+        raise RuntimeError("'molecule > geometry' option is mandatory!")
+
+    if parameter["molecule"]["geometry"] == "-":
+        parameter["molecule"]["geometry"] = read_geometry_from_stdin()
+
+    validate_parameter(params=parameter)
+
+    if options.preflight:
+        geometry_path = parameter["molecule"]["geometry"]
+        if not os.path.isabs(geometry_path):
+            geometry_path = os.path.join(param_dir, geometry_path)
+        preflight_check(parameter, geometry_path)
+
+    parameter["molecule"]["geometry"] = handle_geometry_conversion(
+        parameter["molecule"]["geometry"], param_dir
+    )
+
+    if options.basis_mirror is not None:
+        turbodir = mirror_basis_library(
+            options.basis_mirror, read_coord_elements(parameter["molecule"]["geometry"])
+        )
+        options = replace(
+            options, environment=dict(options.environment or {}, TURBODIR=turbodir)
+        )
+
+    if type(parameter["molecule"].get("mo_guess")) is str and not os.path.isabs(
+        parameter["molecule"]["mo_guess"]
+    ):
+        parameter["molecule"]["mo_guess"] = os.path.abspath(
+            os.path.join(param_dir, parameter["molecule"]["mo_guess"])
+        )
+
+    if options.checkpoint_dir is not None:
+        keys = checkpoint_keys(parameter)
+        checkpoint = find_checkpoint(options.checkpoint_dir, keys)
+        if checkpoint is not None:
+            record_job_metadata(
+                {"checkpoint": {"stage": checkpoint[0], "control": checkpoint[1]}}
+            )
+        run_define(parameter, options, checkpoint=checkpoint)
+        save_checkpoints(options.checkpoint_dir, keys)
+    else:
+        run_define(parameter, options)
+
+    ri_options = parameter.get("calculation", {}).get("ri", {})
+    if ri_options.get("memory") == "auto":
+        ri_memory = choose_ri_memory("control", options)
+        set_control_keyword("control", "ricore", str(ri_memory["ricore"]))
+        record_job_metadata({"ri_memory": ri_memory})
+        print("Set RI memory to {} MiB".format(ri_memory["ricore"]))
+
+    run_cosmoprep(parameter, options)
+
+    if parameter.get("parallel", {}).get("enable", False):
+        configure_parallel_runtime(parameter["parallel"], options)
+
+    if options.store_dir is not None:
+        store_artifacts(options.store_dir)
+
+
+def set_control_keyword(
+    control_path: str, name: str, value: str = "", body: Sequence[str] = ()
+):
+    # Replaces the $name section of the control file by the given header value and body lines
+    # (or adds the section before $end)
+    header = "$" + name
+    section = [(header + " " + value).rstrip()] + list(body)
+
+    with open(control_path, "r") as control_file:
+        lines = control_file.read().splitlines()
+
+    start = next(
+        (
+            i
+            for i, x in enumerate(lines)
+            if x.rstrip() == header or x.startswith(header + " ")
+        ),
+        None,
+    )
+    if start is not None:
+        end = start + 1
+        while end < len(lines) and not lines[end].startswith("$"):
+            end += 1
+        lines[start:end] = section
+    else:
+        end = next((i for i, x in enumerate(lines) if x.rstrip() == "$end"), len(lines))
+        lines[end:end] = section
+
+    with open(control_path, "w") as control_file:
+        control_file.write("".join(x + "\n" for x in lines))
+
+
+# Per-job record of the decisions taken during the preparation
+job_metadata_file = "prep_metadata.json"
+
+
+def record_job_metadata(entries: Dict[str, Any], directory: str = "."):
+    path = os.path.join(directory, job_metadata_file)
+
+    metadata: Dict[str, Any] = {}
+    if os.path.isfile(path):
+        with open(path, "r") as metadata_file:
+            metadata = json.load(metadata_file)
+    metadata.update(entries)
+
+    temp_path = "{}.{}.tmp".format(path, worker_name())
+    with open(temp_path, "w") as metadata_file:
+        json.dump(metadata, metadata_file, indent=2)
+        metadata_file.write("\n")
+    os.replace(temp_path, path)
+
+
+# Directories in $TURBODIR that contain the basis set libraries (one file per element)
+basis_library_dirs = ["basen", "jbasen", "jkbasen", "cbasen", "cabasen"]
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    import fcntl
+
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def copy_hashed(source: str, destination: str) -> str:
+    # Atomically copies source to destination and returns the SHA-256 of the copied content
+    temp_path = "{}.{}.tmp".format(destination, worker_name())
+    digest = hashlib.sha256()
+    with open(source, "rb") as src, open(temp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+
+    os.replace(temp_path, destination)
+    return digest.hexdigest()
+
+
+def mirror_basis_library(mirror_dir: str, elements: List[str]) -> str:
+    # Creates (or updates) a copy of $TURBODIR in which the basis set library files of the
+    # given elements are local copies while everything else links back to the original.
+    # Returns the path to be used as TURBODIR.
+    source_root = os.environ.get("TURBODIR")
+    if source_root is None:
+        raise RuntimeError(
+            "TURBODIR has to be set in order to mirror the basis set library"
+        )
+    source_root = os.path.abspath(source_root)
+
+    root = os.path.abspath(os.path.join(mirror_dir, "turbodir"))
+    manifest_path = os.path.join(mirror_dir, "mirror.json")
+    os.makedirs(mirror_dir, exist_ok=True)
+
+    # The mirror is shared by all jobs running on the node
+    with file_lock(os.path.join(mirror_dir, "mirror.lock")):
+        manifest: Dict[str, Any] = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+
+        if manifest.get("source") != source_root:
+            if os.path.exists(root):
+                shutil.rmtree(root)
+            manifest = {"source": source_root, "files": {}}
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+            for entry in os.listdir(source_root):
+                source = os.path.join(source_root, entry)
+                if entry in basis_library_dirs and os.path.isdir(source):
+                    os.mkdir(os.path.join(root, entry))
+                    for name in os.listdir(source):
+                        os.symlink(
+                            os.path.join(source, name), os.path.join(root, entry, name)
+                        )
+                else:
+                    os.symlink(source, os.path.join(root, entry))
+
+        files = manifest["files"]
+        n_copied = 0
+        for library in basis_library_dirs:
+            for element in sorted(set(elements)):
+                relative_path = os.path.join(library, element)
+                source = os.path.join(source_root, relative_path)
+                target = os.path.join(root, relative_path)
+                try:
+                    stat = os.stat(source)
+                except FileNotFoundError:
+                    continue
+
+                # A local copy is valid as long as the source hasn't been modified since copying it
+                # and the copy itself is still intact
+                recorded = files.get(relative_path)
+                if (
+                    recorded is not None
+                    and recorded["mtime_ns"] == stat.st_mtime_ns
+                    and recorded["size"] == stat.st_size
+                    and os.path.isfile(target)
+                    and not os.path.islink(target)
+                ):
+                    if hash_file(target) == recorded["sha256"]:
+                        continue
+                    print(
+                        "Warning: Mirrored copy '{}' is corrupted - copying it again".format(
+                            target
+                        ),
+                        file=sys.stderr,
+                    )
+
+                files[relative_path] = {
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    "sha256": copy_hashed(source, target),
+                }
+                n_copied += 1
+
+        temp_path = "{}.{}.tmp".format(manifest_path, worker_name())
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    if n_copied > 0:
+        print("Mirrored {} basis set library files to '{}'".format(n_copied, root))
+
+    return root
+
+
+# Generated files that are never modified by TurboMole's programs and can thus be shared
+# between jobs (control and the MO files on the other hand are updated in-place)
+deduplicated_artifacts = ["basis", "auxbasis", "jbasis", "jkbasis", "cbasis", "cabasis"]
+
+# ioctl request for creating a copy-on-write clone of a file on Linux
+FICLONE = 0x40049409
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def link_or_clone(source: str, destination: str) -> bool:
+    # Replaces destination by a hard link to (or if that's not possible a reflink of) source
+    temp_path = "{}.{}.tmp".format(destination, worker_name())
+
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        try:
+            import fcntl
+
+            with open(source, "rb") as src, open(temp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (OSError, ImportError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    os.replace(temp_path, destination)
+    return True
+
+
+def store_artifacts(store_dir: str, directory: str = "."):
+    for name in deduplicated_artifacts:
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path) or os.path.islink(path):
+            continue
+
+        digest = hash_file(path)
+        object_path = os.path.join(store_dir, "objects", digest[:2], digest[2:])
+
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = "{}.{}.tmp".format(object_path, worker_name())
+            shutil.copyfile(path, temp_path)
+            # Stored objects are shared between jobs and must therefore never be modified
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, object_path)
+
+        if os.path.samefile(object_path, path):
+            continue
+
+        if not link_or_clone(object_path, path):
+            print("Warning: Unable to deduplicate '{}' via the store".format(path))
+
+
+def iterate_store_objects(store_dir: str) -> Iterator[os.DirEntry]:
+    objects_dir = os.path.join(store_dir, "objects")
+    if not os.path.isdir(objects_dir):
+        return
+
+    with os.scandir(objects_dir) as prefixes:
+        for prefix in prefixes:
+            if not prefix.is_dir():
+                continue
+            with os.scandir(prefix.path) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        yield entry
+
+
+def print_store_report(store_dir: str):
+    n_objects = 0
+    n_unused = 0
+    n_references = 0
+    stored_bytes = 0
+    referenced_bytes = 0
+
+    for entry in iterate_store_objects(store_dir):
+        stat = entry.stat()
+        n_objects += 1
+        stored_bytes += stat.st_size
+        # Every hard link except for the store's own is a job referencing the object
+        n_references += stat.st_nlink - 1
+        referenced_bytes += stat.st_size * (stat.st_nlink - 1)
+        if stat.st_nlink == 1:
+            n_unused += 1
+
+    print("Objects in store:     {} ({} unused)".format(n_objects, n_unused))
+    print("References from jobs: {}".format(n_references))
+    print("Stored size:          {:.1f} MiB".format(stored_bytes / 2**20))
+    print("Referenced size:      {:.1f} MiB".format(referenced_bytes / 2**20))
+    print(
+        "Space saved:          {:.1f} MiB".format(
+            (referenced_bytes - stored_bytes) / 2**20
+        )
+    )
+    print("(reflinked copies are not included in these numbers)")
+
+
+def collect_store_garbage(store_dir: str):
+    n_removed = 0
+    freed_bytes = 0
+
+    for entry in iterate_store_objects(store_dir):
+        stat = entry.stat()
+        if stat.st_nlink > 1:
+            continue
+
+        # No job directory links to this object anymore (reflinked copies are independent of it)
+        os.remove(entry.path)
+        n_removed += 1
+        freed_bytes += stat.st_size
+
+    print(
+        "Removed {} unused object(s) from the store ({:.1f} MiB)".format(
+            n_removed, freed_bytes / 2**20
+        )
+    )
+
+
+@contextmanager
+def working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def describe_error(error: Exception) -> str:
+    # pexpect's exceptions carry a multi-line dump of the spawn object - the first line suffices
+    lines = str(error).strip().splitlines()
+    message = lines[0] if len(lines) > 0 else ""
+    return "{}: {}".format(type(error).__name__, message)
+
+
+def read_manifest(manifest_path: str) -> Iterator[Dict[str, Any]]:
+    # The manifest is consumed line by line such that arbitrarily large manifests
+    # can be processed without loading them into memory as a whole
+    with open(manifest_path, "r") as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise RuntimeError(
+                    "Invalid JSON in line {} of manifest '{}': {}".format(
+                        line_number, manifest_path, e
+                    )
+                )
+
+            if type(entry) is not dict:
+                raise RuntimeError(
+                    "Line {} of manifest '{}' is not a JSON object".format(
+                        line_number, manifest_path
+                    )
+                )
+            if type(entry.get("id")) is not str:
+                raise RuntimeError(
+                    "Line {} of manifest '{}' lacks a job 'id' (string)".format(
+                        line_number, manifest_path
+                    )
+                )
+            if type(entry.get("parameter")) is not dict:
+                raise RuntimeError(
+                    "Job '{}' in manifest '{}' lacks a 'parameter' object".format(
+                        entry["id"], manifest_path
+                    )
+                )
+            if type(entry.get("directory", "")) is not str:
+                raise RuntimeError(
+                    "Expected 'directory' of job '{}' to be of type 'str'".format(
+                        entry["id"]
+                    )
+                )
+
+            yield entry
+
+
+def read_journal_records(journal_path: str) -> Iterator[Dict[str, Any]]:
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, "r") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn record written by a process that died mid-write
+                continue
+
+            if type(record) is dict and type(record.get("id")) is str:
+                yield record
+
+
+def read_journal(journal_path: str) -> Dict[str, str]:
+    # Maps the ids of all jobs in the journal to their last recorded status
+    return {
+        record["id"]: record.get("status", "")
+        for record in read_journal_records(journal_path)
+    }
+
+
+def append_to_journal(journal_path: str, record: Dict[str, Any]):
+    data = (json.dumps(record) + "\n").encode("utf-8")
+
+    with open(journal_path, "a+b") as journal:
+        if journal.seek(0, os.SEEK_END) > 0:
+            journal.seek(-1, os.SEEK_END)
+            if journal.read(1) != b"\n":
+                # Terminate a torn record left behind by an interrupted run
+                data = b"\n" + data
+
+        journal.write(data)
+        journal.flush()
+        # Make sure the record survives a crash of the node
+        os.fsync(journal.fileno())
+
+
+def manifest_geometry(entry: Dict[str, Any], base_dir: str) -> Optional[str]:
+    # Absolute path of the geometry of a manifest entry (if it is a file)
+    molecule = entry["parameter"].get("molecule")
+    geometry = molecule.get("geometry") if type(molecule) is dict else molecule
+    if type(geometry) is not str or geometry == "-":
+        return None
+    return os.path.join(base_dir, geometry)
+
+
+def set_aside_previous_attempt(
+    job_dir: str,
+    previous_files: Optional[List[str]],
+    geometry: Optional[str],
+    options: PreparationOptions = PreparationOptions(),
+) -> Optional[str]:
+    # Moves the files created by a previous (failed or interrupted) attempt of a job, which would make
+    # the new attempt fail, into a new subdirectory of the job's quarantine directory (whose path is
+    # returned). If the files present before that attempt aren't known, the files written during a
+    # preparation are moved. Input files (like the geometry) stay in place in any case.
+    quarantine_dir = os.path.join(job_dir, options.quarantine_dir)
+    generated = [
+        "control",
+        "coord",
+        "mos",
+        "alpha",
+        "beta",
+        "tmp.input",
+        job_metadata_file,
+        parallel_environment_file,
+    ] + deduplicated_artifacts
+
+    leftovers: List[str] = []
+    for name in sorted(os.listdir(job_dir)):
+        path = os.path.join(job_dir, name)
+        if os.path.realpath(path) == os.path.realpath(quarantine_dir):
+            continue
+        if geometry is not None and os.path.realpath(path) == os.path.realpath(
+            geometry
+        ):
+            continue
+        if previous_files is not None:
+            if name in previous_files:
+                continue
+        elif not name in generated and not name.endswith(".transcript"):
+            continue
+        leftovers.append(name)
+
+    if len(leftovers) == 0:
+        return None
+
+    os.makedirs(quarantine_dir, exist_ok=True)
+    attempt_dir = tempfile.mkdtemp(
+        prefix="attempt-{}-".format(time.strftime("%Y%m%d-%H%M%S")),
+        dir=quarantine_dir,
+    )
+    for name in leftovers:
+        os.rename(os.path.join(job_dir, name), os.path.join(attempt_dir, name))
+
+    return attempt_dir
+
+
+def run_manifest(
+    manifest_path: str,
+    journal_path: Optional[str] = None,
+    options: PreparationOptions = PreparationOptions(),
+) -> int:
+    if journal_path is None:
+        journal_path = manifest_path + ".journal"
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    statuses: Dict[str, str] = {}
+    # Files that were present in the jobs' directories before their last attempt
+    previous_files: Dict[str, List[str]] = {}
+    for record in read_journal_records(journal_path):
+        statuses[record["id"]] = record.get("status", "")
+        if type(record.get("files")) is list:
+            previous_files[record["id"]] = record["files"]
+    completed = set(x for x in statuses if statuses[x] == "done")
+
+    if len(completed) > 0:
+        print(
+            "Resuming from journal '{}' ({} completed jobs will be skipped)".format(
+                journal_path, len(completed)
+            )
+        )
+
+    n_done = 0
+    n_failed = 0
+    n_skipped = 0
+
+    for entry in read_manifest(manifest_path):
+        job_id: str = entry["id"]
+
+        if job_id in completed:
+            n_skipped += 1
+            continue
+
+        job_dir = os.path.normpath(
+            os.path.join(base_dir, entry.get("directory", job_id))
+        )
+
+        if options.index_path is not None and is_up_to_date(
+            options.index_path, job_dir, entry["parameter"], base_dir
+        ):
+            n_skipped += 1
+            continue
+
+        if job_id in statuses and os.path.isdir(job_dir):
+            attempt_dir = set_aside_previous_attempt(
+                job_dir,
+                previous_files.get(job_id),
+                manifest_geometry(entry, base_dir),
+                options,
+            )
+            if attempt_dir is not None:
+                print(
+                    "Moved output of the previous attempt of job '{}' to '{}'".format(
+                        job_id, attempt_dir
+                    )
+                )
+
+        print("Preparing job '{}' in '{}'".format(job_id, job_dir))
+        append_to_journal(
+            journal_path,
+            {
+                "id": job_id,
+                "status": "started",
+                "files": sorted(os.listdir(job_dir)) if os.path.isdir(job_dir) else [],
+            },
+        )
+
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+            with working_directory(job_dir):
+                prepare_calculation(entry["parameter"], base_dir, options)
+        except Exception as e:
+            error = describe_error(e)
+            print("Job '{}' failed: {}".format(job_id, error))
+            append_to_journal(
+                journal_path, {"id": job_id, "status": "failed", "error": error}
+            )
+            n_failed += 1
+            continue
+
+        append_to_journal(journal_path, {"id": job_id, "status": "done"})
+        n_done += 1
+
+    print(
+        "Manifest processed: {} done, {} failed, {} skipped".format(
+            n_done, n_failed, n_skipped
+        )
+    )
+
+    return n_failed
+
+
+def read_geometry_from_stdin() -> str:
+    # Stores the geometry (XYZ or TurboMole format) given on stdin in the current directory
+    content = sys.stdin.read()
+    if len(content.strip()) == 0:
+        raise RuntimeError("Expected a geometry on stdin, but got nothing")
+
+    path = "stdin_coord" if "$coord" in content else "stdin_geometry.xyz"
+    with open(path, "w") as geometry_file:
+        geometry_file.write(content)
+
+    return os.path.abspath(path)
+
+
+def default_scratch_root() -> Optional[str]:
+    # Prefer tmpfs over the system's default temporary directory
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+def archive_compression(path: str) -> str:
+    if path.endswith(".tar.zst") or path.endswith(".tzst"):
+        return "zstd"
+    if path.endswith(".tar.gz") or path.endswith(".tgz"):
+        return "gzip"
+    return "none"
+
+
+def write_archive(directory: str, output: Any, compression: str = "none"):
+    # Streams all files in directory as a tar archive into the given binary file object
+    compressor = None
+    if compression == "zstd":
+        try:
+            import zstandard  # type: ignore
+        except ImportError:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        compressor = zstandard.ZstdCompressor().stream_writer(output, closefd=False)
+        output = compressor
+    elif compression not in ["none", "gzip"]:
+        raise RuntimeError("Unknown compression '{}'".format(compression))
+
+    with tarfile.open(
+        fileobj=output, mode="w|gz" if compression == "gzip" else "w|"
+    ) as archive:
+        for name in sorted(os.listdir(directory)):
+            archive.add(os.path.join(directory, name), arcname=name)
+
+    if compressor is not None:
+        compressor.close()
+
+
+def prepare_in_scratch(
+    parameter: Dict[str, Any],
+    param_dir: str,
+    archive_path: str,
+    options: PreparationOptions = PreparationOptions(),
+    scratch_root: Optional[str] = None,
+    compression: Optional[str] = None,
+):
+    # Prepares the job in a private scratch directory and writes all generated files as a single
+    # archive to archive_path ("-" for stdout), so that the target file system only sees one
+    # sequential write per job
+    if compression is None:
+        compression = archive_compression(archive_path)
+
+    to_stdout = archive_path == "-"
+    if to_stdout:
+        # There is no location the job could be found under later on
+        options = replace(options, index_path=None)
+    param_dir = os.path.abspath(param_dir)
+    scratch_dir = tempfile.mkdtemp(
+        prefix="prep_turbomole_",
+        dir=scratch_root if scratch_root is not None else default_scratch_root(),
+    )
+
+    try:
+        # stdout is reserved for the archive
+        with redirect_stdout(sys.stderr if to_stdout else sys.stdout):
+            with working_directory(scratch_dir):
+                prepare_calculation(
+                    parameter,
+                    param_dir,
+                    options,
+                    location=None if to_stdout else os.path.abspath(archive_path),
+                )
+    except BaseException:
+        # Scratch space (usually tmpfs) is not the place to leave failed jobs in
+        if options.debug:
+            print(
+                "Preparation failed - keeping scratch directory '{}' for inspection".format(
+                    scratch_dir
+                ),
+                file=sys.stderr,
+            )
+        elif options.on_failure == "quarantine":
+            quarantine_dir = os.path.join(
+                "." if to_stdout else os.path.dirname(os.path.abspath(archive_path)),
+                options.quarantine_dir,
+            )
+            os.makedirs(quarantine_dir, exist_ok=True)
+            quarantine_path = shutil.move(scratch_dir, quarantine_dir)
+            print(
+                "Preparation failed - moved scratch directory to '{}'".format(
+                    quarantine_path
+                ),
+                file=sys.stderr,
+            )
+        else:
+            shutil.rmtree(scratch_dir)
+        raise
+
+    try:
+        if to_stdout:
+            write_archive(scratch_dir, sys.stdout.buffer, compression)
+            sys.stdout.buffer.flush()
+        else:
+            temp_path = "{}.{}.tmp".format(archive_path, worker_name())
+            try:
+                with open(temp_path, "wb") as archive_file:
+                    write_archive(scratch_dir, archive_file, compression)
+                os.replace(temp_path, archive_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+    finally:
+        shutil.rmtree(scratch_dir)
+
+
+index_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    directory TEXT PRIMARY KEY,
+    parameters TEXT NOT NULL,
+    input_hashes TEXT NOT NULL,
+    host TEXT,
+    started REAL,
+    finished REAL,
+    outcome TEXT,
+    error TEXT,
+    metadata TEXT
+)
+"""
+
+
+def open_index(index_path: str) -> sqlite3.Connection:
+    # Used as context manager, the connection commits (or rolls back) the statements executed within
+    # The default (rollback) journal is kept as opposed to WAL mode, which requires all processes
+    # accessing the index to be on the same node
+    connection = sqlite3.connect(index_path, timeout=60)
+    connection.execute(index_schema)
+    return connection
+
+
+def normalize_parameters(parameter: Dict[str, Any], param_dir: str) -> Dict[str, Any]:
+    # Returns a copy of the parameters with all shortcuts expanded and absolute paths
+    parameter = json.loads(json.dumps(parameter))
+    parameter = expand_param_shortcuts(params=parameter)
+    parameter = handle_legacy_parameter(params=parameter)
+
+    if not "molecule" in parameter or not "geometry" in parameter["molecule"]:
+        raise RuntimeError("'molecule > geometry' option is mandatory!")
+
+    molecule = parameter["molecule"]
+    for key in ["geometry", "mo_guess"]:
+        if type(molecule.get(key)) is str and molecule[key] != "-":
+            molecule[key] = os.path.abspath(os.path.join(param_dir, molecule[key]))
+
+    return parameter
+
+
+def hash_inputs(parameter: Dict[str, Any]) -> Dict[str, str]:
+    # Hashes of all files the preparation depends on (besides the parameters themselves)
+    paths = [parameter["molecule"]["geometry"]]
+    if "mo_guess" in parameter["molecule"]:
+        paths.extend(
+            os.path.join(parameter["molecule"]["mo_guess"], x)
+            for x in ["control", "mos", "alpha", "beta"]
+        )
+
+    return {x: hash_file(x) for x in paths if os.path.isfile(x)}
+
+
+def is_up_to_date(
+    index_path: str, directory: str, parameter: Dict[str, Any], param_dir: str
+) -> bool:
+    # Whether the job has already been prepared successfully in directory with the same parameters
+    # and inputs (and its files are still there)
+    if not os.path.isfile(index_path) or not os.path.isfile(
+        os.path.join(directory, "control")
+    ):
+        return False
+
+    parameter = normalize_parameters(parameter, param_dir)
+    if parameter["molecule"]["geometry"] == "-":
+        return False
+
+    with open_index(index_path) as index:
+        row = index.execute(
+            "SELECT parameters, input_hashes, outcome FROM jobs WHERE directory = ?",
+            [os.path.realpath(directory)],
+        ).fetchone()
+
+    return (
+        row is not None
+        and row[2] == "done"
+        and row[0] == json.dumps(parameter, sort_keys=True)
+        and row[1] == json.dumps(hash_inputs(parameter), sort_keys=True)
+    )
+
+
+# Columns of the index that can be filtered on directly (everything else refers to the parameters)
+index_columns = ["directory", "host", "outcome", "error"]
+
+
+def query_index(index_path: str, filters: List[str], output=sys.stdout):
+    # Prints the jobs matching all filters (of the form key=value, where key is a column or a
+    # path into the normalized parameters like calculation.dft.functional) as JSON lines
+    conditions: List[str] = []
+    values: List[Any] = []
+    for current in filters:
+        if not "=" in current:
+            raise RuntimeError(
+                "Expected a filter of the form key=value, got '{}'".format(current)
+            )
+        key, value = current.split("=", 1)
+
+        if key in index_columns:
+            conditions.append("{} = ?".format(key))
+            values.append(os.path.realpath(value) if key == "directory" else value)
+            continue
+
+        if re.fullmatch(r"[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*", key) is None:
+            raise RuntimeError("Invalid parameter path '{}'".format(key))
+        # Values are compared as JSON values (strings case-insensitively)
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            parsed = value
+        if type(parsed) is bool:
+            parsed = int(parsed)
+        conditions.append(
+            "json_extract(parameters, '$.{}') = ? COLLATE NOCASE".format(key)
+        )
+        values.append(parsed)
+
+    if not os.path.isfile(index_path):
+        raise RuntimeError("Index '{}' doesn't exist".format(index_path))
+
+    with open_index(index_path) as index:
+        rows = index.execute(
+            "SELECT directory, outcome, error, host, started, finished FROM jobs{} ORDER BY directory".format(
+                " WHERE " + " AND ".join(conditions) if len(conditions) > 0 else ""
+            ),
+            values,
+        ).fetchall()
+
+    for directory, outcome, error, host, started, finished in rows:
+        output.write(
+            json.dumps(
+                {
+                    "directory": directory,
+                    "outcome": outcome,
+                    "error": error,
+                    "host": host,
+                    "duration": round(finished - started, 3),
+                }
+            )
+            + "\n"
+        )
+
+
+spool_subdirs = ["incoming", "claimed", "results", "done", "failed"]
+
+
+def worker_name() -> str:
+    return "{}@{}".format(socket.gethostname(), os.getpid())
+
+
+def claim_next_job(spool_dir: str, worker: str) -> Optional[Tuple[str, str]]:
+    # Jobs are claimed by renaming them into the claimed directory. As renames are atomic (also on
+    # shared file systems), only a single worker can succeed in claiming any given job.
+    incoming = os.path.join(spool_dir, "incoming")
+
+    with os.scandir(incoming) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+
+            claimed_path = os.path.join(
+                spool_dir, "claimed", "{}@{}".format(entry.name, worker)
+            )
+            try:
+                os.rename(entry.path, claimed_path)
+            except FileNotFoundError:
+                # Some other worker was faster
+                continue
+
+            # The modification time of a claim serves as the worker's heartbeat
+            os.utime(claimed_path)
+
+            return entry.name, claimed_path
+
+    return None
+
+
+def is_claim_stale(claim: str, stale_after: float) -> bool:
+    _, host, pid = os.path.basename(claim).rsplit("@", 2)
+
+    if host == socket.gethostname():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+
+    return time.time() - os.stat(claim).st_mtime > stale_after
+
+
+def set_aside_results(result_dir: str):
+    # Results of earlier attempts are kept for inspection rather than being overwritten
+    if os.path.exists(result_dir):
+        os.rename(result_dir, "{}.stale-{}".format(result_dir, int(time.time())))
+
+
+def reap_stale_claims(spool_dir: str, stale_after: float):
+    with os.scandir(os.path.join(spool_dir, "claimed")) as entries:
+        for entry in entries:
+            if entry.name.count("@") < 2:
+                continue
+
+            try:
+                if not is_claim_stale(entry.path, stale_after):
+                    continue
+            except (FileNotFoundError, ValueError):
+                continue
+
+            job_name = entry.name.rsplit("@", 2)[0]
+            job_id = job_name[: -len(".json")]
+
+            # Move partial results of the abandoned attempt out of the way
+            set_aside_results(os.path.join(spool_dir, "results", job_id))
+
+            try:
+                os.rename(entry.path, os.path.join(spool_dir, "incoming", job_name))
+            except FileNotFoundError:
+                # The job has been finished or reaped by someone else in the meantime
+                continue
+
+            print("Re-queued abandoned job '{}' ({})".format(job_id, entry.name))
+
+
+@contextmanager
+def heartbeat(path: str, interval: float):
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_spool_job(
+    spool_dir: str,
+    job_name: str,
+    claimed_path: str,
+    options: PreparationOptions,
+    stale_after: float,
+) -> bool:
+    job_id = job_name[: -len(".json")]
+    result_dir = os.path.join(spool_dir, "results", job_id)
+    status: Dict[str, Any] = {
+        "id": job_id,
+        "worker": worker_name(),
+        "started": time.time(),
+    }
+
+    print("Preparing job '{}'".format(job_id))
+
+    with heartbeat(claimed_path, max(1.0, stale_after / 4)):
+        try:
+            with open(claimed_path, "r") as param_file:
+                parameter = json.load(param_file)
+
+            if options.index_path is not None and is_up_to_date(
+                options.index_path,
+                result_dir,
+                parameter,
+                os.path.join(spool_dir, "incoming"),
+            ):
+                print("Job '{}' is up to date".format(job_id))
+                status["skipped"] = True
+            else:
+                set_aside_results(result_dir)
+                os.makedirs(result_dir)
+                with working_directory(result_dir):
+                    prepare_calculation(
+                        parameter, os.path.join(spool_dir, "incoming"), options
+                    )
+            status["status"] = "done"
+        except Exception as e:
+            status["status"] = "failed"
+            status["error"] = describe_error(e)
+            print("Job '{}' failed: {}".format(job_id, status["error"]))
+
+    status["finished"] = time.time()
+
+    status_path = os.path.join(spool_dir, "results", job_id + ".status.json")
+    with open(status_path + ".tmp", "w") as status_file:
+        json.dump(status, status_file, indent=4)
+    os.replace(status_path + ".tmp", status_path)
+
+    os.rename(claimed_path, os.path.join(spool_dir, status["status"], job_name))
+
+    return status["status"] == "done"
+
+
+def spool_worker(
+    spool_dir: str,
+    options: PreparationOptions,
+    drain: bool,
+    poll_interval: float,
+    stale_after: float,
+    stop: Any,
+    reports: Any,
+    profiler: Optional[ProfilingHook],
+):
+    # Stopping is handled by the supervising process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    if profiler is not None:
+        # Start from scratch - a forked worker inherits whatever the supervisor has collected so far
+        session_hooks[:] = [x for x in session_hooks if x is not profiler]
+        profiler = ProfilingHook()
+        register_hook(profiler)
+
+    worker = worker_name()
+    n_failed = 0
+
+    while not stop.is_set():
+        claim = claim_next_job(spool_dir, worker)
+
+        if claim is None:
+            if drain:
+                break
+            stop.wait(poll_interval)
+            continue
+
+        if not process_spool_job(spool_dir, claim[0], claim[1], options, stale_after):
+            n_failed += 1
+
+    reports.put((n_failed, profiler))
+
+
+def serve_spool(
+    spool_dir: str,
+    n_workers: int = 1,
+    options: PreparationOptions = PreparationOptions(),
+    drain: bool = False,
+    poll_interval: float = 2.0,
+    stale_after: float = 3600.0,
+    profiler: Optional[ProfilingHook] = None,
+) -> int:
+    # Returns the number of jobs that failed while serving
+    spool_dir = os.path.abspath(spool_dir)
+    for current in spool_subdirs:
+        os.makedirs(os.path.join(spool_dir, current), exist_ok=True)
+
+    reap_stale_claims(spool_dir, stale_after)
+
+    stop = multiprocessing.Event()
+    # Workers report their number of failed jobs and their timings when they're done
+    reports: Any = multiprocessing.Queue()
+    n_failed = 0
+
+    def start_worker() -> multiprocessing.Process:
+        worker = multiprocessing.Process(
+            target=spool_worker,
+            args=(
+                spool_dir,
+                options,
+                drain,
+                poll_interval,
+                stale_after,
+                stop,
+                reports,
+                profiler,
+            ),
+        )
+        worker.start()
+        return worker
+
+    def collect_reports():
+        nonlocal n_failed
+        while True:
+            try:
+                worker_failed, worker_profiler = reports.get_nowait()
+            except queue.Empty:
+                return
+            n_failed += worker_failed
+            if profiler is not None and worker_profiler is not None:
+                profiler.merge(worker_profiler)
+
+    def request_stop(*_):
+        print("Stopping after the currently running jobs have finished")
+        stop.set()
+
+    previous_handlers = (
+        signal.signal(signal.SIGINT, request_stop),
+        signal.signal(signal.SIGTERM, request_stop),
+    )
+
+    print("Serving '{}' with {} worker(s)".format(spool_dir, n_workers))
+
+    try:
+        workers = [start_worker() for _ in range(max(1, n_workers))]
+
+        while any(x.is_alive() for x in workers):
+            stop.wait(poll_interval)
+            # Workers can only exit once their report has been received
+            collect_reports()
+            reap_stale_claims(spool_dir, stale_after)
+
+            if not drain and not stop.is_set():
+                # Replace crashed workers (their jobs have just been re-queued)
+                workers = [x if x.is_alive() else start_worker() for x in workers]
+
+        for worker in workers:
+            worker.join()
+        collect_reports()
+    finally:
+        signal.signal(signal.SIGINT, previous_handlers[0])
+        signal.signal(signal.SIGTERM, previous_handlers[1])
+
+    return n_failed
+
+
+def count_basis_functions(section: List[str]) -> Dict[Tuple[str, str], int]:
+    # Maps (element, basis set name) to the number of (spherical) basis functions
+    # for every basis set in the given section of a basis(-type) file
+    angular_momenta = "spdfghik"
+    counts: Dict[Tuple[str, str], int] = {}
+    current: Optional[Tuple[str, str]] = None
+
+    for line in section:
+        header_match = re.match(r"^([a-z]{1,2})\s+(\S+)", line)
+        if header_match is not None:
+            current = (header_match.group(1), header_match.group(2))
+            counts[current] = 0
+            continue
+
+        shell_match = re.match(r"^\s*\d+\s+([spdfghik])\s*$", line)
+        if shell_match is not None and current is not None:
+            counts[current] += 2 * angular_momenta.index(shell_match.group(1)) + 1
+
+    return counts
+
+
+def count_job_basis_functions(control_path: str, kind: str) -> int:
+    # kind is the name of the basis set type (e.g. "basis" or "jbas") as used in $atoms
+    # and the name of the section of the basis set file
+    section = read_control_section(control_path, kind)
+    if section is None:
+        return 0
+
+    counts = count_basis_functions(section)
+    elements = read_coord_elements(control_path)
+    assignment = read_atom_basis_sets(control_path, kind)
+
+    return sum(
+        counts.get((x, assignment.get(i + 1, "")), 0) for i, x in enumerate(elements)
+    )
+
+
+def point_group_order(group: str) -> int:
+    group = group.lower()
+    special = {
+        "ci": 2,
+        "cs": 2,
+        "t": 12,
+        "td": 24,
+        "th": 24,
+        "o": 24,
+        "oh": 48,
+        "i": 60,
+        "ih": 120,
+    }
+    if group in special:
+        return special[group]
+
+    group_match = re.fullmatch(r"([cds])(\d+)([vhd]?)", group)
+    if group_match is None:
+        return 1
+
+    kind, n, suffix = (
+        group_match.group(1),
+        int(group_match.group(2)),
+        group_match.group(3),
+    )
+    if kind == "d":
+        return 4 * n if suffix != "" else 2 * n
+    if kind == "c" and suffix != "":
+        return 2 * n
+
+    return n
+
+
+def has_control_section(control_path: str, name: str) -> bool:
+    return read_control_section(control_path, name) is not None
+
+
+def scf_work_memory(n_bf: int, n_aux: int) -> int:
+    # Fock, density and overlap matrices plus the Coulomb metric for RI (in bytes)
+    return 8 * (4 * n_bf**2 + n_aux**2)
+
+
+def ri_integral_size(n_bf: int, n_aux: int, order: int) -> float:
+    # Size (in bytes) of the symmetry-unique 3-center integrals (mn|P)
+    return 8.0 * n_bf * (n_bf + 1) / 2 * n_aux / order
+
+
+def estimate_job_cost(directory: str) -> Dict[str, Any]:
+    # Rough estimate of the resource requirements of the SCF calculation prepared in directory.
+    # The cost is only meant for ranking jobs relative to each other.
+    control_path = os.path.join(directory, "control")
+    if not os.path.isfile(control_path):
+        raise RuntimeError("No control file found in '{}'".format(directory))
+
+    symmetry = (
+        read_control_section(control_path, "symmetry", include_header=True)
+        or ["$symmetry c1"]
+    )[0]
+    symmetry = symmetry.split()[1] if len(symmetry.split()) > 1 else "c1"
+    order = point_group_order(symmetry)
+
+    n_bf = count_job_basis_functions(control_path, "basis")
+    use_rij = has_control_section(control_path, "rij")
+    use_rik = has_control_section(control_path, "rik")
+    n_aux = 0
+    if use_rik:
+        n_aux = count_job_basis_functions(control_path, "jkbas")
+    elif use_rij:
+        n_aux = count_job_basis_functions(control_path, "jbas")
+
+    x2c = has_control_section(control_path, "rx2c")
+    cosmo = has_control_section(control_path, "cosmo")
+    dft = has_control_section(control_path, "dft")
+
+    # Cost of the integrals (per SCF iteration) plus the diagonalization
+    if use_rik:
+        cost = n_bf**3 * n_aux / order
+    elif use_rij:
+        cost = n_bf**2 * n_aux / order
+        if not dft:
+            # Hartree-Fock exchange is still computed conventionally
+            cost += n_bf**4 / order
+    else:
+        cost = n_bf**4 / order
+    cost += n_bf**3
+
+    if x2c:
+        cost *= 1.5
+    if cosmo:
+        cost *= 1.1
+
+    memory = scf_work_memory(n_bf, n_aux)
+    ricore = read_control_section(control_path, "ricore", include_header=True)
+    if ricore is not None and len(ricore[0].split()) > 1:
+        memory += int(ricore[0].split()[1]) * 2**20
+
+    # Conventional calculations store (a part of) the 4-center integrals on disk, while RI
+    # calculations need the 3-center integrals that don't fit into $ricore
+    if use_rij or use_rik:
+        disk = max(0.0, ri_integral_size(n_bf, n_aux, order) - memory)
+    else:
+        disk = 8.0 * n_bf**4 / (8 * order)
+
+    return {
+        "directory": directory,
+        "atoms": len(read_coord_elements(control_path)),
+        "basis_functions": n_bf,
+        "auxiliary_functions": n_aux,
+        "symmetry": symmetry,
+        "symmetry_order": order,
+        "ri": "rijk" if use_rik else ("rij" if use_rij else None),
+        "x2c": x2c,
+        "cosmo": cosmo,
+        "memory_mb": round(memory / 2**20, 1),
+        "disk_mb": round(disk / 2**20, 1),
+        "cost": cost,
+    }
+
+
+# Bounds (in MiB) for the automatically chosen $ricore
+min_ri_memory = 200
+# Memory of a job that is neither covered by $ricore nor by the SCF matrices (in MiB)
+ri_memory_reserve = 500
+
+
+def available_memory() -> int:
+    # Memory (in MiB) available for new processes, limited by the cgroup (if any)
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    if available is None:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2**20
+
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as limit_file:
+            limit = limit_file.read().strip()
+        if limit != "max":
+            available = min(available, int(limit) // 2**20)
+    except (OSError, ValueError):
+        pass
+
+    return available
+
+
+def choose_ri_memory(
+    control_path: str, options: PreparationOptions = PreparationOptions()
+) -> Dict[str, Any]:
+    # Picks $ricore such that all concurrent jobs fit into the node's memory, but not larger
+    # than what's needed to keep all 3-center integrals in memory
+    kind = "jkbas" if has_control_section(control_path, "rik") else "jbas"
+    n_bf = count_job_basis_functions(control_path, "basis")
+    n_aux = count_job_basis_functions(control_path, kind)
+
+    symmetry = (
+        read_control_section(control_path, "symmetry", include_header=True)
+        or ["$symmetry c1"]
+    )[0].split()
+    order = point_group_order(symmetry[1] if len(symmetry) > 1 else "c1")
+
+    if options.node_memory is not None:
+        node_memory = options.node_memory
+    else:
+        node_memory = available_memory()
+        print(
+            "Warning: No --node-memory given - sizing the RI memory for the {} MiB that are available on this machine, which might not be the one the job runs on".format(
+                node_memory
+            ),
+            file=sys.stderr,
+        )
+    share = node_memory // max(1, options.concurrent_jobs)
+    budget = share - ri_memory_reserve - scf_work_memory(n_bf, n_aux) // 2**20
+    required = int(ri_integral_size(n_bf, n_aux, order) // 2**20) + 1
+
+    ricore = max(min_ri_memory, min(required, budget))
+    if ricore > budget:
+        print(
+            "Warning: Only {} MiB of memory are available per job ({} concurrent jobs), using the minimal RI memory of {} MiB".format(
+                share, options.concurrent_jobs, ricore
+            ),
+            file=sys.stderr,
+        )
+
+    return {
+        "ricore": ricore,
+        "node_memory": node_memory,
+        "concurrent_jobs": options.concurrent_jobs,
+        "basis_functions": n_bf,
+        "auxiliary_functions": n_aux,
+        "integral_memory": required,
+    }
+
+
+# Name of the (sourceable) file holding the environment for running the job in parallel
+parallel_environment_file = "turbomole_env.sh"
+
+# Number of basis functions per thread/process below which parallelization doesn't pay off
+basis_functions_per_thread = 50
+
+
+def node_core_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def configure_parallel_runtime(
+    params: Dict[str, Any],
+    options: PreparationOptions = PreparationOptions(),
+    control_path: str = "control",
+):
+    architecture = params.get("architecture", "SMP").upper()
+    if not architecture in ["SMP", "MPI"]:
+        raise RuntimeError("Unknown parallel architecture '{}'".format(architecture))
+
+    nodes = params.get("nodes", 1)
+    if architecture == "SMP" and nodes != 1:
+        raise RuntimeError("SMP runs are limited to a single node")
+
+    if "cores" in params:
+        node_cores = params["cores"]
+    else:
+        node_cores = node_core_count()
+        if not "threads" in params:
+            print(
+                "Warning: No 'parallel > cores' given - assuming that the nodes have as many cores as this machine ({}), which might not be the one the job runs on".format(
+                    node_cores
+                ),
+                file=sys.stderr,
+            )
+
+    # Cores of one node that are available to this job
+    cores = max(1, node_cores // max(1, options.concurrent_jobs))
+
+    n_bf = count_job_basis_functions(control_path, "basis")
+    if "threads" in params:
+        workers = params["threads"]
+    else:
+        workers = max(1, min(nodes * cores, n_bf // basis_functions_per_thread))
+
+    environment = {
+        "PARA_ARCH": architecture,
+        "PARNODES": str(workers),
+        # MPI runs use one process per core
+        "OMP_NUM_THREADS": str(workers if architecture == "SMP" else 1),
+    }
+    if "scratch" in params:
+        environment["TURBOTMPDIR"] = params["scratch"]
+
+    with open(parallel_environment_file, "w") as environment_file:
+        environment_file.write("# Generated by prep_turbomole_calc.py\n")
+        for key, value in environment.items():
+            environment_file.write("export {}={}\n".format(key, shlex.quote(value)))
+
+    if architecture == "SMP":
+        set_control_keyword(control_path, "smp_cpus", str(workers))
+    if "scratch" in params:
+        set_control_keyword(control_path, "tmpdir", params["scratch"])
+
+    record_job_metadata(
+        {"parallel": dict(environment, nodes=nodes, cores=cores, basis_functions=n_bf)}
+    )
+    print(
+        "Configured {} run with {} {}".format(
+            architecture, workers, "threads" if architecture == "SMP" else "processes"
+        )
+    )
+
+
+def assign_bins(estimates: List[Dict[str, Any]], n_bins: int):
+    # Greedily distribute the jobs (most expensive first) onto the bin with the smallest total cost
+    totals = [0.0] * n_bins
+    for estimate in sorted(estimates, key=lambda x: -x["cost"]):
+        target = totals.index(min(totals))
+        estimate["bin"] = target
+        totals[target] += estimate["cost"]
+
+
+def iterate_job_directories(
+    paths: List[str],
+) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    # Manifests (*.jsonl) are expanded into the directories of their jobs, which are
+    # returned together with the respective manifest entry
+    for path in paths:
+        if not path.endswith(".jsonl"):
+            yield path, None
+            continue
+
+        base_dir = os.path.dirname(os.path.abspath(path))
+        for entry in read_manifest(path):
+            job_dir = os.path.normpath(
+                os.path.join(base_dir, entry.get("directory", entry["id"]))
+            )
+            yield job_dir, entry
+
+
+def estimate_batch(
+    paths: List[str], output_path: Optional[str] = None, n_bins: int = 0
+):
+    estimates: List[Dict[str, Any]] = []
+    for directory, entry in iterate_job_directories(paths):
+        try:
+            estimate = estimate_job_cost(directory)
+            if entry is not None:
+                # Keep the manifest fields such that the output can be used as a manifest again
+                estimate = dict(entry, **estimate)
+            estimates.append(estimate)
+        except (RuntimeError, OSError) as e:
+            print("Warning: Skipping '{}': {}".format(directory, e), file=sys.stderr)
+
+    if n_bins > 0:
+        assign_bins(estimates, n_bins)
+
+    estimates.sort(key=lambda x: -x["cost"])
+
+    output = open(output_path, "w") if output_path is not None else sys.stdout
+    try:
+        for estimate in estimates:
+            output.write(json.dumps(estimate) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run define with a set of pre-defined parameters in order to prepare a TurboMole computation"
@@ -1014,12 +3884,183 @@ def main():
         default=10,
         type=int,
     )
+    parser.add_argument(
+        "--skip-preflight",
+        help="Don't sanity-check the geometry (atom count, elements, overlapping atoms, length units) before running define",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--concurrent-jobs",
+        help='Number of jobs that will run concurrently on one node (used to size the RI memory for "memory": "auto")',
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--node-memory",
+        help='Memory (in MiB) available on the nodes the jobs will run on (used for "memory": "auto", defaults to '
+        + "the memory that is currently available on this machine, which is rarely what you want)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--basis-mirror",
+        help="Node-local directory (e.g. on tmpfs) into which the basis set library files needed by the jobs are "
+        + "mirrored, so that define reads them from there instead of from $TURBODIR",
+        default=None,
+    )
+    parser.add_argument(
+        "--deadline",
+        help="Maximum total time (in seconds) a define/cosmoprep session may take before it is killed",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--on-failure",
+        help="What to do with the files created or modified by a failed job: keep them, roll the job's directory back "
+        + "to its previous state or roll back and move the files into the quarantine directory (defaults to keep for "
+        + "single jobs and to quarantine for manifests and spool directories)",
+        choices=["keep", "rollback", "quarantine"],
+        default=None,
+    )
+    parser.add_argument(
+        "--quarantine",
+        help="Directory (relative to the job's directory) into which --on-failure quarantine moves the files",
+        default="quarantine",
+    )
+    parser.add_argument(
+        "--transcript-size",
+        help="Size (in bytes) of the in-memory transcript of every define/cosmoprep session that is written to disk "
+        + "if the session fails (0 disables transcripts)",
+        default=256 * 1024,
+        type=int,
+    )
+    parser.add_argument(
+        "--compress-transcript",
+        help="Keep the in-memory transcripts compressed",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print a summary of where the time was spent in the define/cosmoprep sessions",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "--cd",
         help="Execute in the directory of the parameter file instead of the present working directory",
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--archive",
+        help="Prepare the job in a private scratch directory and write all generated files as a tar archive to the "
+        + "given path ('-' for stdout). Archives ending in .tar.gz/.tgz are gzip- and ones ending in .tar.zst/.tzst "
+        + "zstd-compressed",
+        metavar="PATH",
+        default=None,
+    )
+    parser.add_argument(
+        "--archive-compression",
+        help="Compression of the archive (overrides the compression derived from the archive's name)",
+        choices=["none", "gzip", "zstd"],
+        default=None,
+    )
+    parser.add_argument(
+        "--scratch",
+        help="Directory in which the private scratch directories for --archive are created (default: /dev/shm if "
+        + "available, the system's temporary directory otherwise)",
+        metavar="DIR",
+        default=None,
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Prepare all jobs listed in the given JSON-lines manifest instead of a single parameter file",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Journal of completed and failed manifest jobs (default: <manifest>.journal)",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--serve",
+        help="Continuously prepare the parameter files dropped into the 'incoming' subdirectory of the given spool directory",
+        metavar="SPOOL_DIR",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of jobs to prepare concurrently in --serve mode",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--drain",
+        help="In --serve mode, exit once there are no more jobs to be prepared",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stale-after",
+        help="Time (in seconds) after which a claimed job is considered abandoned and is given to a different worker",
+        default=3600,
+        type=float,
+    )
+    parser.add_argument(
+        "--checkpoints",
+        help="Snapshot the geometry and basis set stages of every job into the given directory and resume later jobs "
+        + "from the deepest matching snapshot",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--store",
+        help="Deduplicate the generated basis set files of all jobs into the given content-addressed store",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--store-report",
+        help="Print how much space is saved by the store given via --store and exit",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--store-gc",
+        help="Remove all files from the store given via --store that are no longer used by any job and exit",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--index",
+        help="SQLite database in which every preparation (normalized parameters, input hashes, timings and outcome) "
+        + "is recorded. Jobs of manifests and spool directories that are up to date according to the index are skipped",
+        metavar="PATH",
+        default=None,
+    )
+    parser.add_argument(
+        "--query",
+        help="List the jobs in the index matching all given filters (KEY=VALUE, where KEY is outcome, host, directory, "
+        + "error or a path into the parameters like calculation.dft.functional) and exit",
+        metavar="FILTER",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--estimate",
+        help="Estimate the cost of the already prepared jobs in the given directories (or manifests) and exit",
+        metavar="PATH",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--estimate-output",
+        help="Write the jobs sorted by their estimated cost as JSON lines into this file instead of stdout",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--bins",
+        help="Distribute the jobs analyzed via --estimate onto this many bins of similar total cost",
+        default=0,
+        type=int,
+    )
     parser.add_argument(
         "--dont-execute",
         help=argparse.SUPPRESS,
@@ -1032,29 +4073,109 @@ def main():
     if args.dont_execute:
         return
 
+    if args.query is not None:
+        if args.index is None:
+            raise RuntimeError("--query requires --index")
+        query_index(args.index, args.query)
+        return
+
+    if args.estimate is not None:
+        estimate_batch(
+            args.estimate, output_path=args.estimate_output, n_bins=args.bins
+        )
+        return
+
+    if args.store_report or args.store_gc:
+        if args.store is None:
+            raise RuntimeError("--store-report and --store-gc require --store")
+        if args.store_gc:
+            collect_store_garbage(args.store)
+        if args.store_report:
+            print_store_report(args.store)
+        return
+
+    load_hook_entry_points()
+
+    profiler: Optional[ProfilingHook] = None
+    if args.profile:
+        profiler = ProfilingHook()
+        register_hook(profiler)
+
+    on_failure = args.on_failure
+    if on_failure is None:
+        # When preparing many jobs, the leftovers of failed ones must not get in the way of retrying them
+        batch = args.manifest is not None or args.serve is not None
+        on_failure = "quarantine" if batch else "keep"
+
+    options = PreparationOptions(
+        debug=args.debug,
+        timeout=args.timeout,
+        transcript_size=args.transcript_size,
+        compress_transcript=args.compress_transcript,
+        preflight=not args.skip_preflight,
+        concurrent_jobs=args.concurrent_jobs,
+        node_memory=args.node_memory,
+        deadline=args.deadline,
+        on_failure=on_failure,
+        quarantine_dir=args.quarantine,
+        index_path=os.path.abspath(args.index) if args.index is not None else None,
+        basis_mirror=(
+            os.path.abspath(args.basis_mirror)
+            if args.basis_mirror is not None
+            else None
+        ),
+        store_dir=os.path.abspath(args.store) if args.store is not None else None,
+        checkpoint_dir=(
+            os.path.abspath(args.checkpoints) if args.checkpoints is not None else None
+        ),
+    )
+
+    if args.serve is not None:
+        n_failed = serve_spool(
+            args.serve,
+            n_workers=args.workers,
+            options=options,
+            drain=args.drain,
+            stale_after=args.stale_after,
+            profiler=profiler,
+        )
+        if profiler is not None:
+            profiler.print_summary()
+        sys.exit(1 if n_failed > 0 else 0)
+
+    if args.manifest is not None:
+        n_failed = run_manifest(
+            args.manifest, journal_path=args.journal, options=options
+        )
+        if profiler is not None:
+            profiler.print_summary()
+        sys.exit(1 if n_failed > 0 else 0)
+
     with open(args.parameter, "r") as param_file:
         parameter = json.load(param_file)
 
     param_dir: str = os.path.dirname(args.parameter)
     if len(param_dir) == 0:
         param_dir = "."
-    if args.cd:
+    if args.cd and args.archive is None:
         os.chdir(param_dir)
 
-    parameter = expand_param_shortcuts(params=parameter)
-    parameter = handle_legacy_parameter(params=parameter)
-
-    if not "molecule" in parameter or not "geometry" in parameter["molecule"]:
-        raise RuntimeError("'molecule > geometry' option is mandatory!")
-
-    parameter["molecule"]["geometry"] = handle_geometry_conversion(
-        parameter["molecule"]["geometry"], param_dir
-    )
-
-    validate_parameter(params=parameter)
-
-    run_define(parameter, debug=args.debug, timeout=args.timeout)
-    run_cosmoprep(parameter, debug=args.debug, timeout=args.timeout)
+    try:
+        if args.archive is not None:
+            prepare_in_scratch(
+                parameter,
+                param_dir,
+                args.archive,
+                options,
+                scratch_root=args.scratch,
+                compression=args.archive_compression,
+            )
+        else:
+            prepare_calculation(parameter, param_dir, options)
+    finally:
+        if profiler is not None:
+            with redirect_stdout(sys.stderr if args.archive == "-" else sys.stdout):
+                profiler.print_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+# Prepares the reference calculation whose MOs are used as initial guess
+set -e
+mkdir reference
+cd reference
+python3 "$prep_script" "${script_dir}/04_b_basis_set_shorthand.json"
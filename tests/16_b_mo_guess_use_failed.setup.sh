@@ -0,0 +1,7 @@
+# Prepares a reference calculation that passes the compatibility checks, but whose basis set file is
+# missing, so that define fails to read its MOs
+set -e
+mkdir reference
+cd reference
+python3 "$prep_script" "${script_dir}/04_b_basis_set_shorthand.json"
+rm basis
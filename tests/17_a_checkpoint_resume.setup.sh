@@ -0,0 +1,5 @@
+# Prepares a first job with the same geometry and basis set which populates the checkpoint directory
+set -e
+mkdir first
+cd first
+python3 "$prep_script" --checkpoints ../checkpoints "${script_dir}/04_b_basis_set_shorthand.json"
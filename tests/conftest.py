@@ -0,0 +1,60 @@
+import os
+import sys
+from typing import Any, Dict, List
+
+import pytest
+
+# Make prep_turbomole_calc importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import prep_turbomole_calc as prep  # noqa: E402
+
+
+class FakePreparation:
+    """Stands in for preparing a job in the current directory (i.e. for define & co.)"""
+
+    def __init__(self):
+        # Maps the names of job directories to the exception preparing them raises
+        self.failures: Dict[str, BaseException] = {}
+        # Options passed to every call
+        self.calls: List[Any] = []
+
+    def __call__(self, parameter, param_dir, options=None, location=None):
+        self.calls.append(options)
+
+        # Refuses remnants of a prior run just like run_define does
+        if os.path.exists("control"):
+            raise RuntimeError("remnants of a prior define run")
+
+        molecule = parameter["molecule"]
+        geometry = molecule if type(molecule) is str else molecule["geometry"]
+        if not os.path.isfile(os.path.join(param_dir, geometry)):
+            raise RuntimeError("geometry missing")
+
+        for name in ["coord", "control"]:
+            with open(name, "w") as output_file:
+                output_file.write("$end\n")
+        prep.record_job_metadata({"prepared_by": "fake"})
+        print("Prepared job in '{}'".format(os.getcwd()))
+
+        failure = self.failures.get(os.path.basename(os.getcwd()))
+        if failure is not None:
+            with open("define.transcript", "w") as transcript:
+                transcript.write("transcript\n")
+            raise failure
+
+
+@pytest.fixture
+def fake_preparation(monkeypatch) -> FakePreparation:
+    # Replaces prepare_calculation as a whole (e.g. for testing manifests and spool directories)
+    fake = FakePreparation()
+    monkeypatch.setattr(prep, "prepare_calculation", fake)
+    return fake
+
+
+@pytest.fixture
+def fake_run_preparation(monkeypatch) -> FakePreparation:
+    # Replaces only the actual preparation (e.g. for testing the index and the cleanup of failed jobs)
+    fake = FakePreparation()
+    monkeypatch.setattr(prep, "run_preparation", fake)
+    return fake
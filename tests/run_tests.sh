@@ -30,9 +30,22 @@ fi
 function perform_test {
 	local input="$1"
 	local expectations="$2"
+	local setup="$3"
+	local arguments="$4"
+
+	# Some tests need additional files (e.g. a reference calculation) in their working directory
+	if [[ -f "$setup" ]]; then
+		prep_script="$prep_script" script_dir="$script_dir" bash "$setup" || exit "$?"
+	fi
+
+	# Additional command line arguments (one per line) for the preparation
+	declare -a extra_args=()
+	if [[ -f "$arguments" ]]; then
+		readarray -t extra_args < "$arguments"
+	fi
 
 	# Execute script
-	python3 "$prep_script" "$input" || exit "$?"
+	python3 "$prep_script" "${extra_args[@]}" "$input" || exit "$?"
 
 	local control_file="control"
 
@@ -95,7 +108,7 @@ for current in "${test_inputs[@]}"; do
 	echo -n "Running test $test_name..."
 
 	exit_code=0
-	test_output="$( 2>&1 perform_test "${script_dir}/${test_name}.json" "${script_dir}/${test_name}.grep" | indent )" || exit_code=$?
+	test_output="$( 2>&1 perform_test "${script_dir}/${test_name}.json" "${script_dir}/${test_name}.grep" "${script_dir}/${test_name}.setup.sh" "${script_dir}/${test_name}.args" | indent )" || exit_code=$?
 
 	if [[ "$exit_code" -eq 0 ]]; then
 		echo " Passed."
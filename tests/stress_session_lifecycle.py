@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Runs thousands of failing sessions and checks that neither processes nor partial output are left behind.
+
+Unlike the other tests, this doesn't require TurboMole: the sessions run a shell script that behaves like a
+misbehaving define (it writes partial output, modifies existing files and starts a background process).
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from typing import List, Tuple
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(script_dir))
+
+import prep_turbomole_calc as prep  # noqa: E402
+
+# Writes partial output, modifies an existing file, leaves a process behind and then waits for input forever
+fake_session = "sh -c 'echo partial > control; echo changed >> input; sleep 600 & echo ready; read answer; sleep 600'"
+
+
+def run_failing_session(index: int) -> Tuple[int, List[str]]:
+    # Returns the process group of the session and a list of problems
+    problems: List[str] = []
+    job_dir = tempfile.mkdtemp(prefix="stress_session_")
+    with open(os.path.join(job_dir, "input"), "w") as input_file:
+        input_file.write("original\n")
+
+    # Alternate between sessions that fail with an error and ones that exceed their deadline
+    options = prep.PreparationOptions(
+        timeout=30,
+        transcript_size=0,
+        deadline=0.2 if index % 2 == 1 else None,
+        on_failure="quarantine" if index % 4 < 2 else "rollback",
+    )
+
+    pgid = -1
+    with prep.working_directory(job_dir):
+        try:
+            with prep.interactive_session(fake_session, options) as process:
+                pgid = process.pid or -1
+                process.expect("ready")
+                if options.deadline is None:
+                    raise RuntimeError("Simulated failure")
+                process.expect("never printed")
+            problems.append("session {} didn't fail".format(index))
+        except RuntimeError:
+            pass
+
+        files = sorted(os.listdir("."))
+        with open("input", "r") as input_file:
+            content = input_file.read()
+
+    expected = (
+        ["input", "quarantine"] if options.on_failure == "quarantine" else ["input"]
+    )
+    if files != expected:
+        problems.append("session {} left {}".format(index, files))
+    if content != "original\n":
+        problems.append(
+            "session {} didn't restore the modified input file".format(index)
+        )
+
+    shutil.rmtree(job_dir)
+    return pgid, problems
+
+
+def find_zombies() -> List[int]:
+    zombies: List[int] = []
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return zombies
+        if pid == 0:
+            return zombies
+        zombies.append(pid)
+
+
+def run_batch(indices: List[int]) -> Tuple[List[int], List[str]]:
+    pgids: List[int] = []
+    problems: List[str] = []
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        for index in indices:
+            pgid, session_problems = run_failing_session(index)
+            pgids.append(pgid)
+            problems.extend(session_problems)
+        sys.stdout = sys.__stdout__
+
+    problems.extend("unreaped child process {}".format(x) for x in find_zombies())
+    return pgids, problems
+
+
+def find_processes_in_groups(pgids: List[int]) -> List[int]:
+    remaining: List[int] = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", entry, "stat"), "r") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # The state and process group are the 1st and 3rd field after the (parenthesized) command name.
+        # Terminated processes that were orphaned only wait for being reaped by init.
+        fields = stat[stat.rindex(")") + 2 :].split()
+        if int(fields[2]) in pgids and fields[0] != "Z":
+            remaining.append(int(entry))
+
+    return remaining
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sessions", help="Number of failing sessions", default=2000, type=int
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of parallel workers",
+        default=os.cpu_count() or 1,
+        type=int,
+    )
+    args = parser.parse_args()
+
+    batches = [list(range(i, args.sessions, args.workers)) for i in range(args.workers)]
+    with multiprocessing.Pool(args.workers) as pool:
+        results = pool.map(run_batch, batches)
+
+    pgids = set(x for result in results for x in result[0])
+    problems = [x for result in results for x in result[1]]
+    problems.extend(
+        "leaked process {}".format(x) for x in find_processes_in_groups(list(pgids))
+    )
+
+    for problem in problems[:20]:
+        print(problem)
+    print("{} failing sessions, {} problems".format(args.sessions, len(problems)))
+
+    sys.exit(1 if len(problems) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+@pytest.fixture
+def param_dir(tmp_path):
+    directory = tmp_path / "params"
+    directory.mkdir()
+    (directory / "geometry.xyz").write_text("1\n\nH 0.0 0.0 0.0\n")
+    return directory
+
+
+@pytest.fixture
+def scratch_root(tmp_path):
+    directory = tmp_path / "scratch"
+    directory.mkdir()
+    return directory
+
+
+parameter = {"molecule": {"geometry": "geometry.xyz"}}
+prepared_files = ["control", "coord", prep.job_metadata_file]
+
+
+@pytest.mark.parametrize("name", ["job.tar", "job.tar.gz"])
+def test_archive_round_trip(tmp_path, param_dir, scratch_root, fake_preparation, name):
+    archive_path = tmp_path / name
+    prep.prepare_in_scratch(
+        parameter, str(param_dir), str(archive_path), scratch_root=str(scratch_root)
+    )
+
+    with open(archive_path, "rb") as archive_file:
+        is_gzip = archive_file.read(2) == b"\x1f\x8b"
+    assert is_gzip == name.endswith(".gz")
+
+    with tarfile.open(archive_path) as archive:
+        assert sorted(archive.getnames()) == sorted(prepared_files)
+        control = archive.extractfile("control")
+        assert control is not None and control.read() == b"$end\n"
+
+    # The archive appears atomically and the scratch directory is removed
+    assert sorted(os.listdir(tmp_path)) == sorted([name, "params", "scratch"])
+    assert os.listdir(scratch_root) == []
+
+
+def test_archive_is_renamed_into_place(tmp_path, param_dir, scratch_root, monkeypatch):
+    archive_path = tmp_path / "job.tar"
+    seen = []
+
+    def preparation(parameter, param_dir, options=None, location=None):
+        open("control", "w").close()
+
+    def write_archive(directory, output, compression="none"):
+        # Only the temporary file exists while the archive is being written
+        seen.extend(sorted(os.listdir(tmp_path)))
+        output.write(b"archive")
+
+    monkeypatch.setattr(prep, "prepare_calculation", preparation)
+    monkeypatch.setattr(prep, "write_archive", write_archive)
+    monkeypatch.setattr(prep, "worker_name", lambda: "worker")
+    prep.prepare_in_scratch(
+        parameter, str(param_dir), str(archive_path), scratch_root=str(scratch_root)
+    )
+
+    assert seen == ["job.tar.worker.tmp", "params", "scratch"]
+    assert archive_path.read_bytes() == b"archive"
+
+
+def test_stdout_only_receives_the_archive(
+    param_dir, scratch_root, fake_preparation, capsysbinary
+):
+    prep.prepare_in_scratch(
+        parameter, str(param_dir), "-", scratch_root=str(scratch_root)
+    )
+
+    captured = capsysbinary.readouterr()
+    with tarfile.open(fileobj=io.BytesIO(captured.out)) as archive:
+        assert sorted(archive.getnames()) == sorted(prepared_files)
+    assert b"Prepared job in" in captured.err
+    assert os.listdir(scratch_root) == []
+
+
+def test_failed_preparation_removes_the_scratch_directory(
+    tmp_path, scratch_root, fake_preparation
+):
+    # The geometry is missing
+    with pytest.raises(RuntimeError, match="geometry missing"):
+        prep.prepare_in_scratch(
+            parameter,
+            str(tmp_path),
+            str(tmp_path / "job.tar"),
+            scratch_root=str(scratch_root),
+        )
+
+    assert os.listdir(scratch_root) == []
+    assert not (tmp_path / "job.tar").exists()
+
+
+def test_failed_preparation_keeps_the_scratch_directory_when_debugging(
+    tmp_path, scratch_root, fake_preparation
+):
+    with pytest.raises(RuntimeError, match="geometry missing"):
+        prep.prepare_in_scratch(
+            parameter,
+            str(tmp_path),
+            str(tmp_path / "job.tar"),
+            prep.PreparationOptions(debug=True),
+            scratch_root=str(scratch_root),
+        )
+
+    assert len(os.listdir(scratch_root)) == 1
+
+
+def test_failed_preparation_quarantines_the_scratch_directory(
+    tmp_path, scratch_root, fake_preparation
+):
+    with pytest.raises(RuntimeError, match="geometry missing"):
+        prep.prepare_in_scratch(
+            parameter,
+            str(tmp_path),
+            str(tmp_path / "job.tar"),
+            prep.PreparationOptions(on_failure="quarantine"),
+            scratch_root=str(scratch_root),
+        )
+
+    assert os.listdir(scratch_root) == []
+    quarantined = os.listdir(tmp_path / "quarantine")
+    assert len(quarantined) == 1 and quarantined[0].startswith("prep_turbomole_")
+
+
+def test_failed_archive_leaves_nothing_behind(
+    tmp_path, param_dir, scratch_root, fake_preparation
+):
+    with pytest.raises(RuntimeError, match="Unknown compression"):
+        prep.prepare_in_scratch(
+            parameter,
+            str(param_dir),
+            str(tmp_path / "job.tar"),
+            scratch_root=str(scratch_root),
+            compression="lzma",
+        )
+
+    assert os.listdir(scratch_root) == []
+    assert sorted(os.listdir(tmp_path)) == ["params", "scratch"]
@@ -0,0 +1,37 @@
+import os
+
+import prep_turbomole_calc as prep
+
+
+def make_turbodir(path):
+    for library in ["basen", "jbasen"]:
+        (path / library).mkdir(parents=True)
+        for element in ["h", "o", "cl"]:
+            (path / library / element).write_text("{} {}\n".format(library, element))
+    (path / "bin").mkdir()
+    return str(path)
+
+
+def test_mirror_copies_only_needed_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("TURBODIR", make_turbodir(tmp_path / "turbodir"))
+
+    root = prep.mirror_basis_library(str(tmp_path / "mirror"), ["h", "o"])
+
+    assert not os.path.islink(os.path.join(root, "basen", "h"))
+    assert not os.path.islink(os.path.join(root, "jbasen", "o"))
+    assert os.path.islink(os.path.join(root, "basen", "cl"))
+    assert os.path.islink(os.path.join(root, "bin"))
+
+
+def test_mirror_replaces_corrupted_copies(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("TURBODIR", make_turbodir(tmp_path / "turbodir"))
+    root = prep.mirror_basis_library(str(tmp_path / "mirror"), ["h"])
+    capsys.readouterr()
+
+    with open(os.path.join(root, "basen", "h"), "w") as copy:
+        copy.write("truncated")
+    prep.mirror_basis_library(str(tmp_path / "mirror"), ["h"])
+
+    assert "Mirrored 1 basis set library files" in capsys.readouterr().out
+    with open(os.path.join(root, "basen", "h")) as copy:
+        assert copy.read() == "basen h\n"
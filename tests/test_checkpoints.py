@@ -0,0 +1,140 @@
+import os
+
+import pytest
+
+import prep_turbomole_calc as prep
+
+control = """$title
+$symmetry c1
+$coord    file=coord
+$atoms
+o  1                                                                           \\
+   basis =o def2-SVP                                                           \\
+   jbas  =o universal
+h  2-3                                                                         \\
+   basis =h def2-SVP                                                           \\
+   jkbas =h universal-jkfit
+$basis    file=basis
+$scfmo   file=mos
+$end
+"""
+
+
+@pytest.fixture
+def job_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "control").write_text(control)
+    (tmp_path / "coord").write_text(
+        "$coord\n 0.0 0.0 0.0 o\n 0.0 0.0 1.8 h\n 0.0 1.8 0.0 h\n$end\n"
+    )
+    (tmp_path / "basis").write_text("$basis\n*\no def2-SVP\n*\n$end\n")
+    return tmp_path
+
+
+def make_params(geometry, **molecule):
+    return {"molecule": dict(molecule, geometry=str(geometry)), "basis_set": "def2-SVP"}
+
+
+def test_keys_change_with_the_parameters_of_their_stage(job_dir):
+    keys = prep.checkpoint_keys(make_params(job_dir / "coord"))
+
+    for molecule in [{"detect_symmetry": False}, {"use_internal_coords": False}]:
+        changed = prep.checkpoint_keys(make_params(job_dir / "coord", **molecule))
+        assert changed["geometry"] != keys["geometry"]
+        assert changed["basis"] != keys["basis"]
+
+    params = make_params(job_dir / "coord")
+    params["basis_set"] = "def2-TZVP"
+    changed = prep.checkpoint_keys(params)
+    assert changed["geometry"] == keys["geometry"]
+    assert changed["basis"] != keys["basis"]
+
+    assert prep.checkpoint_keys(make_params(job_dir / "coord")) == keys
+
+
+def test_keys_change_with_the_geometry(job_dir):
+    keys = prep.checkpoint_keys(make_params(job_dir / "coord"))
+
+    (job_dir / "other").write_text(
+        "$coord\n 0.0 0.0 0.0 o\n 0.0 0.0 1.9 h\n 0.0 1.8 0.0 h\n$end\n"
+    )
+    changed = prep.checkpoint_keys(make_params(job_dir / "other"))
+    assert changed["geometry"] != keys["geometry"]
+    assert changed["basis"] != keys["basis"]
+
+
+def test_deepest_stage_is_found(job_dir):
+    checkpoints = job_dir / "checkpoints"
+    keys = prep.checkpoint_keys(make_params(job_dir / "coord"))
+    assert prep.find_checkpoint(str(checkpoints), keys) is None
+
+    prep.save_checkpoints(str(checkpoints), keys)
+    assert sorted(os.listdir(checkpoints)) == [
+        "basis-" + keys["basis"],
+        "geometry-" + keys["geometry"],
+    ]
+    assert prep.find_checkpoint(str(checkpoints), keys) == (
+        "basis",
+        str(checkpoints / ("basis-" + keys["basis"]) / "control"),
+    )
+
+    # A different basis set can still resume from the geometry
+    other = dict(keys, basis="other")
+    assert prep.find_checkpoint(str(checkpoints), other) == (
+        "geometry",
+        str(checkpoints / ("geometry-" + keys["geometry"]) / "control"),
+    )
+
+
+def test_auxiliary_basis_sets_are_stripped():
+    atoms = control.split("$atoms\n")[1].split("$basis")[0].splitlines()
+
+    assert prep.strip_auxiliary_basis_sets(atoms) == [
+        "o  1 \\",
+        "   basis =o def2-SVP",
+        "h  2-3 \\",
+        "   basis =h def2-SVP",
+    ]
+
+
+def test_checkpoints_contain_the_sections_of_their_stages(job_dir):
+    checkpoints = job_dir / "checkpoints"
+    keys = prep.checkpoint_keys(make_params(job_dir / "coord"))
+    prep.save_checkpoints(str(checkpoints), keys)
+
+    geometry = (checkpoints / ("geometry-" + keys["geometry"]) / "control").read_text()
+    assert "$coord\n" in geometry
+    assert "$atoms" not in geometry
+
+    basis = (checkpoints / ("basis-" + keys["basis"]) / "control").read_text()
+    assert "$coord\n" in basis
+    assert "$basis\n*\no def2-SVP\n" in basis
+    assert "jbas" not in basis and "jkbas" not in basis
+    assert "$scfmo" not in basis
+    assert basis.endswith("$end\n")
+
+
+def test_racing_writers_keep_the_first_checkpoint(job_dir, monkeypatch):
+    checkpoints = job_dir / "checkpoints"
+    keys = prep.checkpoint_keys(make_params(job_dir / "coord"))
+    rename = os.rename
+
+    def racing_rename(source, target):
+        # Another worker finishes writing the same checkpoints right before our first rename
+        monkeypatch.setattr(prep.os, "rename", rename)
+        monkeypatch.setattr(prep, "worker_name", lambda: "other")
+        (job_dir / "control").write_text(control.replace("c1", "cs"))
+        prep.save_checkpoints(str(checkpoints), keys)
+        rename(source, target)
+
+    monkeypatch.setattr(prep.os, "rename", racing_rename)
+    prep.save_checkpoints(str(checkpoints), keys)
+
+    # The checkpoints of the other worker are kept and no temporary directories are left behind
+    assert sorted(os.listdir(checkpoints)) == [
+        "basis-" + keys["basis"],
+        "geometry-" + keys["geometry"],
+    ]
+    for stage in ["geometry", "basis"]:
+        path = checkpoints / "{}-{}".format(stage, keys[stage]) / "control"
+        assert "$symmetry cs\n" in path.read_text()
@@ -0,0 +1,83 @@
+import json
+
+import prep_turbomole_calc as prep
+
+control = """$title
+$symmetry c1
+$coord
+    0.0 0.0 0.0 o
+    0.0 0.0 1.8 h
+    0.0 1.8 0.0 h
+$end
+$atoms
+o  1 \\
+   basis =o def2-SVP
+h  2-3 \\
+   basis =h def2-SVP
+$basis    file=basis
+$end
+"""
+
+basis = """$basis
+*
+o def2-SVP
+*
+   3  s
+   1  s
+   1  p
+   1  d
+*
+h def2-SVP
+*
+   2  s
+   1  p
+*
+$end
+"""
+
+
+def prepare_job(directory):
+    directory.mkdir()
+    (directory / "control").write_text(control)
+    (directory / "basis").write_text(basis)
+
+
+def test_job_cost(tmp_path):
+    prepare_job(tmp_path / "water")
+
+    estimate = prep.estimate_job_cost(str(tmp_path / "water"))
+
+    # o: 1 + 1 + 3 + 5, h: 1 + 3 (per atom)
+    assert estimate["basis_functions"] == 18
+    assert estimate["atoms"] == 3
+    assert estimate["ri"] is None
+    assert estimate["cost"] == 18**4 + 18**3
+
+
+def test_manifest_fields_are_kept(tmp_path):
+    prepare_job(tmp_path / "water")
+    prepare_job(tmp_path / "other")
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text(
+        json.dumps({"id": "water", "parameter": {"molecule": "water.xyz"}})
+        + "\n"
+        + json.dumps(
+            {"id": "b", "directory": "other", "parameter": {"molecule": "b.xyz"}}
+        )
+        + "\n"
+    )
+    output = tmp_path / "estimates.jsonl"
+
+    prep.estimate_batch([str(manifest)], str(output), n_bins=2)
+
+    estimates = [json.loads(x) for x in output.read_text().splitlines()]
+    assert sorted(x["id"] for x in estimates) == ["b", "water"]
+    assert sorted(x["bin"] for x in estimates) == [0, 1]
+    by_id = {x["id"]: x for x in estimates}
+    assert by_id["water"]["parameter"] == {"molecule": "water.xyz"}
+    assert by_id["b"]["directory"] == str(tmp_path / "other")
+
+    # The estimates can be used as a manifest again
+    assert [x["id"] for x in prep.read_manifest(str(output))] == [
+        x["id"] for x in estimates
+    ]
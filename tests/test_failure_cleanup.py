@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+@pytest.fixture
+def job_dir(tmp_path, monkeypatch):
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    (job_dir / "geometry.xyz").write_text("1\n\nO 0 0 0\n")
+    (job_dir / "prep_metadata.json").write_text("{}\n")
+    monkeypatch.chdir(job_dir)
+    return job_dir
+
+
+@pytest.mark.parametrize("on_failure", ["rollback", "quarantine"])
+def test_failed_job_is_cleaned_up(job_dir, fake_run_preparation, on_failure):
+    fake_run_preparation.failures["job"] = RuntimeError("cosmoprep failed")
+
+    with pytest.raises(RuntimeError, match="cosmoprep failed"):
+        prep.prepare_calculation(
+            {"molecule": "geometry.xyz"},
+            ".",
+            prep.PreparationOptions(on_failure=on_failure),
+        )
+
+    # The sessions themselves leave the cleanup to the job
+    assert fake_run_preparation.calls[0].on_failure == "keep"
+
+    expected = ["define.transcript", "geometry.xyz", "prep_metadata.json"]
+    if on_failure == "quarantine":
+        expected.append("quarantine")
+    assert sorted(os.listdir(".")) == expected
+    assert (job_dir / "prep_metadata.json").read_text() == "{}\n"
+
+    if on_failure == "quarantine":
+        (quarantine_path,) = (job_dir / "quarantine").iterdir()
+        assert sorted(os.listdir(quarantine_path)) == [
+            "control",
+            "coord",
+            "define.transcript",
+            "failure.json",
+            "prep_metadata.json",
+        ]
+        with open(quarantine_path / "failure.json") as status_file:
+            assert "cosmoprep failed" in json.load(status_file)["error"]
+
+
+def test_failed_job_is_kept_by_default(job_dir, fake_run_preparation):
+    fake_run_preparation.failures["job"] = RuntimeError("cosmoprep failed")
+
+    with pytest.raises(RuntimeError):
+        prep.prepare_calculation({"molecule": "geometry.xyz"}, ".")
+
+    assert sorted(os.listdir(".")) == [
+        "control",
+        "coord",
+        "define.transcript",
+        "geometry.xyz",
+        "prep_metadata.json",
+    ]
@@ -0,0 +1,85 @@
+import pexpect
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+class RecordingHook(prep.SessionHook):
+    def __init__(self):
+        self.events = []
+
+    def phase_enter(self, phase):
+        self.events.append(("phase_enter", phase))
+
+    def phase_exit(self, phase, elapsed, error):
+        self.events.append(("phase_exit", phase, error))
+
+    def send(self, data):
+        self.events.append(("send", data))
+
+    def expect(self, pattern, index, elapsed):
+        self.events.append(("expect", pattern, index))
+
+
+@pytest.fixture
+def hooks(monkeypatch):
+    monkeypatch.setattr(prep, "session_hooks", [])
+    return prep.session_hooks
+
+
+command = "sh -c 'echo a; read x'"
+
+
+def test_hooks_see_sends_and_expects(hooks):
+    hook = RecordingHook()
+    prep.register_hook(hook)
+
+    process = prep.spawn_session(command, prep.PreparationOptions(timeout=10))
+    try:
+        assert isinstance(process, prep.InstrumentedSpawn)
+
+        assert process.expect(["b", "a"]) == 1
+        with pytest.raises(pexpect.TIMEOUT):
+            process.expect("b", timeout=0.2)
+        process.sendline("x")
+        process.expect(pexpect.EOF)
+    finally:
+        process.close()
+
+    assert hook.events == [
+        ("expect", ["b", "a"], 1),
+        ("expect", "b", None),
+        ("send", b"x\n"),
+        ("expect", pexpect.EOF, 0),
+    ]
+
+
+def test_hooks_see_phases(hooks):
+    hook = RecordingHook()
+    prep.register_hook(hook)
+
+    def failing_phase(process, params):
+        raise RuntimeError("failed")
+
+    prep.run_phase(lambda process, params: None, None, {})  # type: ignore
+    with pytest.raises(RuntimeError):
+        prep.run_phase(failing_phase, None, {})  # type: ignore
+
+    assert [x[:2] for x in hook.events] == [
+        ("phase_enter", "<lambda>"),
+        ("phase_exit", "<lambda>"),
+        ("phase_enter", "failing_phase"),
+        ("phase_exit", "failing_phase"),
+    ]
+    assert hook.events[1][2] is None
+    assert isinstance(hook.events[3][2], RuntimeError)
+
+
+def test_plain_spawn_without_hooks(hooks):
+    process = prep.spawn_session(command, prep.PreparationOptions(timeout=10))
+    try:
+        assert type(process) is pexpect.spawn
+        process.sendline("x")
+        process.expect(pexpect.EOF)
+    finally:
+        process.close()
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+def prepare(tmp_path, job_id, parameter):
+    job_dir = tmp_path / job_id
+    job_dir.mkdir()
+    with prep.working_directory(str(job_dir)):
+        prep.prepare_calculation(
+            parameter,
+            str(tmp_path),
+            prep.PreparationOptions(index_path=str(tmp_path / "index.db")),
+        )
+    return str(job_dir)
+
+
+def query(tmp_path, filters):
+    output = io.StringIO()
+    prep.query_index(str(tmp_path / "index.db"), filters, output)
+    return [json.loads(x) for x in output.getvalue().splitlines()]
+
+
+@pytest.fixture
+def index_dir(tmp_path, fake_run_preparation):
+    (tmp_path / "water.xyz").write_text("1\n\nO 0 0 0\n")
+    return tmp_path
+
+
+def test_up_to_date_jobs_are_recognized_via_symlinks(index_dir):
+    parameter = {"molecule": "water.xyz", "basis_set": "def2-SVP"}
+    job_dir = prepare(index_dir, "a", parameter)
+    os.symlink(job_dir, str(index_dir / "link"))
+    index_path = str(index_dir / "index.db")
+
+    assert prep.is_up_to_date(index_path, job_dir, parameter, str(index_dir))
+    assert prep.is_up_to_date(
+        index_path, str(index_dir / "link"), parameter, str(index_dir)
+    )
+    assert not prep.is_up_to_date(
+        index_path, job_dir, dict(parameter, basis_set="def2-TZVP"), str(index_dir)
+    )
+
+    # Changing an input file invalidates the job
+    (index_dir / "water.xyz").write_text("1\n\nO 0 0 1\n")
+    assert not prep.is_up_to_date(index_path, job_dir, parameter, str(index_dir))
+
+
+def test_query_by_parameters(index_dir):
+    prepare(index_dir, "a", {"molecule": "water.xyz", "basis_set": "def2-SVP"})
+    prepare(index_dir, "b", {"molecule": "water.xyz", "basis_set": "def2-TZVP"})
+
+    jobs = query(index_dir, ["basis_set.all=DEF2-tzvp"])
+
+    assert [x["directory"] for x in jobs] == [os.path.realpath(index_dir / "b")]
+    assert jobs[0]["outcome"] == "done"
+    assert len(query(index_dir, ["outcome=done"])) == 2
+    assert (
+        query(index_dir, ["directory={}".format(index_dir / "a")])[0]["outcome"]
+        == "done"
+    )
+
+
+def test_interrupted_preparations_are_recorded(index_dir, fake_run_preparation):
+    fake_run_preparation.failures["a"] = KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        prepare(index_dir, "a", {"molecule": "water.xyz"})
+
+    (job,) = query(index_dir, [])
+    assert job["outcome"] == "interrupted"
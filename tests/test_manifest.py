@@ -0,0 +1,118 @@
+import json
+import os
+
+import prep_turbomole_calc as prep
+
+
+def write_manifest(path, job_ids):
+    with open(path, "w") as manifest:
+        for job_id in job_ids:
+            manifest.write(
+                json.dumps({"id": job_id, "parameter": {"molecule": "geometry.xyz"}})
+                + "\n"
+            )
+
+
+def test_read_journal_skips_torn_and_incomplete_records(tmp_path):
+    journal = tmp_path / "journal"
+    journal.write_text(
+        '{"id": "a", "status": "failed"}\n'
+        '{"status": "done"}\n'
+        '["not", "a", "record"]\n'
+        '{"id": "a", "status": "done"}\n'
+        '{"id": "b", "status": "sta'
+    )
+
+    assert prep.read_journal(str(journal)) == {"a": "done"}
+
+
+def test_append_to_journal_terminates_torn_record(tmp_path):
+    journal = tmp_path / "journal"
+    journal.write_text('{"id": "a", "sta')
+    prep.append_to_journal(str(journal), {"id": "b", "status": "done"})
+
+    assert prep.read_journal(str(journal)) == {"b": "done"}
+
+
+def test_resume_retries_failed_and_interrupted_jobs(tmp_path, fake_preparation):
+    manifest = tmp_path / "jobs.jsonl"
+    write_manifest(manifest, ["a", "b", "c"])
+    (tmp_path / "geometry.xyz").write_text("1\n\nO 0 0 0\n")
+
+    fake_preparation.failures["b"] = RuntimeError("define failed")
+    assert prep.run_manifest(str(manifest)) == 1
+
+    # Simulate a node that died while preparing c
+    journal = str(manifest) + ".journal"
+    with open(journal, "r") as journal_file:
+        records = journal_file.readlines()
+    with open(journal, "w") as journal_file:
+        journal_file.writelines(x for x in records if '"c", "status": "done"' not in x)
+
+    fake_preparation.failures.clear()
+    assert prep.run_manifest(str(manifest)) == 0
+
+    assert prep.read_journal(journal) == {"a": "done", "b": "done", "c": "done"}
+    for job_id in ["b", "c"]:
+        assert (tmp_path / job_id / "control").is_file()
+        (attempt_dir,) = (tmp_path / job_id / "quarantine").iterdir()
+        assert (attempt_dir / "control").is_file()
+    assert not (tmp_path / "a" / "quarantine").exists()
+
+
+def test_retry_keeps_inputs_in_the_job_directory(tmp_path, fake_preparation):
+    job_dir = tmp_path / "jobs" / "a"
+    job_dir.mkdir(parents=True)
+    (job_dir / "geom.xyz").write_text("1\n\nO 0 0 0\n")
+    (job_dir / "notes.txt").write_text("notes\n")
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text(
+        json.dumps(
+            {
+                "id": "a",
+                "directory": "jobs/a",
+                "parameter": {"molecule": "jobs/a/geom.xyz"},
+            }
+        )
+        + "\n"
+    )
+
+    fake_preparation.failures["a"] = RuntimeError("define failed")
+    assert prep.run_manifest(str(manifest)) == 1
+    fake_preparation.failures.clear()
+    assert prep.run_manifest(str(manifest)) == 0
+
+    assert sorted(os.listdir(job_dir)) == [
+        "control",
+        "coord",
+        "geom.xyz",
+        "notes.txt",
+        "prep_metadata.json",
+        "quarantine",
+    ]
+    (attempt_dir,) = (job_dir / "quarantine").iterdir()
+    assert sorted(os.listdir(attempt_dir)) == [
+        "control",
+        "coord",
+        "define.transcript",
+        "prep_metadata.json",
+    ]
+
+
+def test_retry_without_recorded_files_only_moves_generated_files(
+    tmp_path, fake_preparation
+):
+    # Journals without the list of files present before an attempt
+    manifest = tmp_path / "jobs.jsonl"
+    write_manifest(manifest, ["a"])
+    (tmp_path / "geometry.xyz").write_text("1\n\nO 0 0 0\n")
+    (tmp_path / "jobs.jsonl.journal").write_text('{"id": "a", "status": "failed"}\n')
+    (tmp_path / "a").mkdir()
+    for name in ["control", "basis", "define.transcript", "notes.txt"]:
+        (tmp_path / "a" / name).write_text(name + "\n")
+
+    assert prep.run_manifest(str(manifest)) == 0
+
+    assert (tmp_path / "a" / "notes.txt").is_file()
+    (attempt_dir,) = (tmp_path / "a" / "quarantine").iterdir()
+    assert sorted(os.listdir(attempt_dir)) == ["basis", "control", "define.transcript"]
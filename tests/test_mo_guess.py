@@ -0,0 +1,34 @@
+import prep_turbomole_calc as prep
+
+
+def test_broken_reference_is_reported_as_mismatch(tmp_path):
+    reference = tmp_path / "reference"
+    reference.mkdir()
+    # A control file without $coord section
+    (reference / "control").write_text("$title\n$scfmo file=mos\n$end\n")
+    (reference / "mos").write_text("$scfmo\n$end\n")
+
+    coord = tmp_path / "coord"
+    coord.write_text("$coord\n 0.0 0.0 0.0 h\n 0.0 0.0 1.4 h\n$end\n")
+
+    reason = prep.check_mo_guess_compatibility(
+        str(reference), {"molecule": {"geometry": str(coord)}}
+    )
+    assert reason is not None and "No $coord section" in reason
+
+
+def test_matching_reference_is_accepted(tmp_path):
+    coord = "$coord\n 0.0 0.0 0.0 h\n 0.0 0.0 1.4 h\n"
+    (tmp_path / "control").write_text(
+        coord
+        + "$closed shells\n a       1                                      ( 2 )\n$end\n"
+    )
+    (tmp_path / "mos").write_text("$scfmo\n$end\n")
+    (tmp_path / "coord").write_text(coord + "$end\n")
+
+    assert (
+        prep.check_mo_guess_compatibility(
+            str(tmp_path), {"molecule": {"geometry": str(tmp_path / "coord")}}
+        )
+        is None
+    )
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+def write_xyz(path, atoms):
+    lines = [str(len(atoms)), ""]
+    lines += ["{} {} {} {}".format(element, *position) for element, position in atoms]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def check(tmp_path, atoms):
+    prep.preflight_check({"molecule": {}}, write_xyz(tmp_path / "mol.xyz", atoms))
+
+
+def test_close_pairs_match_brute_force():
+    rng = np.random.default_rng(42)
+    coords = rng.uniform(-8, 8, size=(300, 3))
+
+    i, j, distances = prep.find_close_pairs(coords, cutoff=2.0)
+
+    found = {(a, b): d for a, b, d in zip(i.tolist(), j.tolist(), distances.tolist())}
+    expected = {
+        (a, b): np.linalg.norm(coords[a] - coords[b])
+        for a in range(len(coords))
+        for b in range(a + 1, len(coords))
+        if np.linalg.norm(coords[a] - coords[b]) < 2.0
+    }
+    assert found.keys() == expected.keys()
+    assert all(found[x] == pytest.approx(expected[x]) for x in expected)
+
+
+def test_hydrogen_molecule_passes(tmp_path):
+    check(tmp_path, [("H", (0, 0, 0)), ("H", (0, 0, 0.741))])
+
+
+def test_isolated_hydrogen_only_warns(tmp_path, capsys):
+    check(tmp_path, [("H", (0, 0, 0)), ("He", (0, 0, 3.0))])
+
+    assert "unable to check the length unit" in capsys.readouterr().out
+
+
+def test_bohr_in_xyz_file_is_rejected(tmp_path):
+    # Water in Bohr
+    with pytest.raises(RuntimeError, match="Bohr instead of Å"):
+        check(
+            tmp_path,
+            [("O", (0, 0, 0)), ("H", (0, 1.43, 1.11)), ("H", (0, -1.43, 1.11))],
+        )
+
+
+def test_overlapping_atoms_are_rejected(tmp_path):
+    with pytest.raises(RuntimeError, match="Overlapping atoms"):
+        check(tmp_path, [("C", (0, 0, 0)), ("O", (0, 0, 0.2))])
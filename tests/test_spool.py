@@ -0,0 +1,75 @@
+import json
+import os
+
+import prep_turbomole_calc as prep
+
+
+def make_spool(tmp_path, job_ids):
+    spool_dir = tmp_path / "spool"
+    for current in prep.spool_subdirs:
+        (spool_dir / current).mkdir(parents=True)
+    for job_id in job_ids:
+        (spool_dir / "incoming" / (job_id + ".json")).write_text(
+            json.dumps({"molecule": "geometry.xyz"})
+        )
+    (spool_dir / "incoming" / "geometry.xyz").write_text("1\n\nO 0 0 0\n")
+    return str(spool_dir)
+
+
+def test_jobs_are_claimed_only_once(tmp_path):
+    spool_dir = make_spool(tmp_path, ["a", "b"])
+
+    claims = [prep.claim_next_job(spool_dir, "w@host@{}".format(i)) for i in range(3)]
+
+    assert claims[2] is None
+    assert sorted(x[0] for x in claims if x is not None) == ["a.json", "b.json"]
+    assert os.listdir(os.path.join(spool_dir, "incoming")) == ["geometry.xyz"]
+    assert len(os.listdir(os.path.join(spool_dir, "claimed"))) == 2
+
+
+def test_stale_claims_are_requeued(tmp_path):
+    spool_dir = make_spool(tmp_path, ["a"])
+    claim = prep.claim_next_job(spool_dir, "host@12345")
+    assert claim is not None
+    os.makedirs(os.path.join(spool_dir, "results", "a"))
+
+    # The claim's heartbeat is recent, but it is too old for a stale_after of -1
+    prep.reap_stale_claims(spool_dir, stale_after=-1)
+
+    assert sorted(os.listdir(os.path.join(spool_dir, "incoming"))) == [
+        "a.json",
+        "geometry.xyz",
+    ]
+    assert os.listdir(os.path.join(spool_dir, "claimed")) == []
+    results = os.listdir(os.path.join(spool_dir, "results"))
+    assert len(results) == 1 and results[0].startswith("a.stale-")
+
+
+def test_resubmitted_job_sets_aside_earlier_results(tmp_path, fake_preparation):
+    spool_dir = make_spool(tmp_path, ["a"])
+    os.makedirs(os.path.join(spool_dir, "results", "a"))
+    (tmp_path / "spool" / "results" / "a" / "control").write_text("$end\n")
+
+    claim = prep.claim_next_job(spool_dir, prep.worker_name())
+    assert claim is not None
+    assert prep.process_spool_job(
+        spool_dir, claim[0], claim[1], prep.PreparationOptions(), stale_after=60
+    )
+
+    assert os.listdir(os.path.join(spool_dir, "done")) == ["a.json"]
+    results = sorted(os.listdir(os.path.join(spool_dir, "results")))
+    assert len(results) == 3 and results[0] == "a" and results[2] == "a.status.json"
+    assert results[1].startswith("a.stale-")
+
+
+def test_serve_reports_failed_jobs(tmp_path, fake_preparation):
+    fake_preparation.failures["b"] = RuntimeError("define failed")
+    spool_dir = make_spool(tmp_path, ["a", "b", "c"])
+
+    n_failed = prep.serve_spool(spool_dir, n_workers=2, drain=True, poll_interval=0.1)
+
+    assert n_failed == 1
+    assert sorted(os.listdir(os.path.join(spool_dir, "done"))) == ["a.json", "c.json"]
+    assert os.listdir(os.path.join(spool_dir, "failed")) == ["b.json"]
+    with open(os.path.join(spool_dir, "results", "b.status.json")) as status_file:
+        assert "define failed" in json.load(status_file)["error"]
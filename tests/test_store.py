@@ -0,0 +1,114 @@
+import fcntl
+import os
+import stat
+
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+@pytest.fixture
+def store(tmp_path):
+    return tmp_path / "store"
+
+
+def make_job(directory, **files):
+    directory.mkdir()
+    for name, content in files.items():
+        (directory / name).write_bytes(content)
+    return directory
+
+
+def store_objects(store):
+    return sorted(x.path for x in prep.iterate_store_objects(str(store)))
+
+
+def test_identical_files_share_a_single_object(tmp_path, store):
+    a = make_job(tmp_path / "a", basis=b"$basis\n*\nh def2-SVP\n", control=b"$end\n")
+    b = make_job(tmp_path / "b", basis=b"$basis\n*\nh def2-SVP\n", control=b"$end\n")
+
+    prep.store_artifacts(str(store), str(a))
+    prep.store_artifacts(str(store), str(b))
+
+    objects = store_objects(store)
+    assert len(objects) == 1
+    assert os.stat(objects[0]).st_nlink == 3
+    assert os.path.samefile(a / "basis", b / "basis")
+    # Only the artifacts that are never modified in-place are deduplicated
+    assert os.stat(a / "control").st_nlink == 1
+
+    # The shared object must not be modified through any of the jobs
+    assert stat.S_IMODE(os.stat(objects[0]).st_mode) & 0o222 == 0
+    assert (a / "basis").read_bytes() == b"$basis\n*\nh def2-SVP\n"
+
+    # Storing a job again doesn't change anything
+    prep.store_artifacts(str(store), str(a))
+    assert store_objects(store) == objects
+    assert os.stat(objects[0]).st_nlink == 3
+
+
+def test_different_files_are_stored_separately(tmp_path, store):
+    a = make_job(tmp_path / "a", basis=b"def2-SVP\n")
+    b = make_job(tmp_path / "b", basis=b"def2-TZVP\n")
+
+    prep.store_artifacts(str(store), str(a))
+    prep.store_artifacts(str(store), str(b))
+
+    objects = store_objects(store)
+    assert len(objects) == 2
+    assert all(os.stat(x).st_nlink == 2 for x in objects)
+    assert (b / "basis").read_bytes() == b"def2-TZVP\n"
+
+
+def test_failed_link_leaves_the_file_untouched(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    source.write_text("stored\n")
+    destination = tmp_path / "destination"
+    destination.write_text("original\n")
+
+    def fail(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(prep.os, "link", fail)
+    monkeypatch.setattr(fcntl, "ioctl", fail)
+
+    assert not prep.link_or_clone(str(source), str(destination))
+    assert destination.read_text() == "original\n"
+    assert sorted(os.listdir(tmp_path)) == ["destination", "source"]
+
+
+def test_garbage_collection_only_removes_unused_objects(tmp_path, store, capsys):
+    a = make_job(tmp_path / "a", basis=b"shared\n")
+    b = make_job(tmp_path / "b", basis=b"shared\n", jbasis=b"referenced\n")
+    c = make_job(tmp_path / "c", auxbasis=b"unused\n")
+    for job in [a, b, c]:
+        prep.store_artifacts(str(store), str(job))
+    (c / "auxbasis").unlink()
+
+    prep.collect_store_garbage(str(store))
+
+    objects = store_objects(store)
+    assert sorted(os.stat(x).st_nlink for x in objects) == [2, 3]
+    assert (b / "jbasis").read_bytes() == b"referenced\n"
+    assert "Removed 1 unused object(s)" in capsys.readouterr().out
+
+
+def test_report(tmp_path, store, capsys):
+    mib = 2**20
+    a = make_job(tmp_path / "a", basis=b"b" * mib)
+    b = make_job(tmp_path / "b", basis=b"b" * mib, jbasis=b"j" * (mib // 2))
+    c = make_job(tmp_path / "c", auxbasis=b"a" * (mib // 4))
+    for job in [a, b, c]:
+        prep.store_artifacts(str(store), str(job))
+    (c / "auxbasis").unlink()
+
+    prep.print_store_report(str(store))
+
+    report = capsys.readouterr().out.splitlines()
+    assert report[:5] == [
+        "Objects in store:     3 (1 unused)",
+        "References from jobs: 3",
+        "Stored size:          1.8 MiB",
+        "Referenced size:      2.5 MiB",
+        "Space saved:          0.8 MiB",
+    ]
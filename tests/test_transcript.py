@@ -0,0 +1,62 @@
+import pytest
+
+import prep_turbomole_calc as prep
+
+
+def test_buffer_keeps_everything_below_capacity():
+    buffer = prep.TranscriptBuffer(100, block_size=10)
+    buffer.write(b"a" * 25)
+    buffer.write(b"b" * 25)
+
+    assert buffer.getvalue() == b"a" * 25 + b"b" * 25
+    assert buffer.dropped == 0
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_oldest_blocks_are_evicted_at_capacity(compress):
+    buffer = prep.TranscriptBuffer(40, compress=compress, block_size=10)
+    data = bytes(range(65, 65 + 26)) * 4
+    for i in range(0, len(data), 7):
+        buffer.write(data[i : i + 7])
+
+    value = buffer.getvalue()
+    assert len(value) <= 40
+    assert buffer.dropped + len(value) == len(data)
+    assert data.endswith(value)
+    # Eviction happens in whole blocks
+    assert buffer.dropped % 10 == 0
+
+
+def test_dump_mentions_dropped_bytes(tmp_path):
+    buffer = prep.TranscriptBuffer(20, block_size=10)
+    buffer.write(b"0123456789" * 5 + b"tail")
+
+    buffer.dump(str(tmp_path / "transcript"))
+
+    header, content = (tmp_path / "transcript").read_bytes().split(b"\n", 1)
+    assert header == "[... {} earlier bytes discarded ...]".format(
+        buffer.dropped
+    ).encode("utf-8")
+    assert buffer.dropped == 40
+    assert content == b"0123456789tail"
+
+
+def test_dump_without_eviction_has_no_header(tmp_path):
+    buffer = prep.TranscriptBuffer(1000, compress=True)
+    buffer.write(b"define ended normally\n")
+
+    buffer.dump(str(tmp_path / "transcript"))
+
+    assert (tmp_path / "transcript").read_bytes() == b"define ended normally\n"
+
+
+def test_compressed_blocks_round_trip():
+    payload = b"".join(
+        "line {} of the session\n".format(i).encode("utf-8") for i in range(2000)
+    )
+    buffer = prep.TranscriptBuffer(len(payload), compress=True, block_size=1024)
+    buffer.write(payload)
+
+    assert buffer.getvalue() == payload
+    # The sealed blocks are actually stored compressed
+    assert sum(len(x) for _, x in buffer.blocks) < buffer.sealed_size / 2